@@ -1,9 +1,27 @@
+"""The vacuum world (agents.py) and the agents playing in it.
+
+The agent modules are imported when one of their classes is first used,
+so importing the package costs only agents.py: agent_dir.DeepBumpClass
+imports DeepBump.py then.  agent_list.load_agents() finds the agents
+without importing them.
+"""
+
+import importlib
+
 from . agents import Agent, Wall, Dirt, Clean
-from . AvalonVacuumAgent import AvalonVacuumAgentClass
-from . DeepBump import DeepBumpClass
-from . EconomicVacuumAgent_EVA01 import EconomicVacuumAgent_EVA01Class
-from . GBAgent24R import GBAgent24RClass
-from . ManhattanAgent import ManhattanAgentClass
-from .AgentXTypeOne import AgentXTypeOneClass
-from .AgentXTypeTwo import AgentXTypeTwoClass
-from .AgentXTypeThree import AgentXTypeThreeClass
+
+
+def __getattr__(name):
+    # An agent class is named after its module: DeepBumpClass is in DeepBump
+    modname = name[:-len('Class')]
+    if name.endswith('Class') and modname and not name.startswith('_'):
+        try:
+            module = importlib.import_module('.' + modname, __name__)
+        except ImportError as e:
+            if e.name != '{0}.{1}'.format(__name__, modname):
+                raise
+        else:
+            if hasattr(module, name):
+                return getattr(module, name)
+    raise AttributeError(
+        "module {0!r} has no attribute {1!r}".format(__name__, name))
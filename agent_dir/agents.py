@@ -35,10 +35,19 @@ EnvCanvas ## Canvas to display the environment of an EnvGUI
 #
 # Speed control in GUI does not have any effect -- fix it.
 
-from utils import *
+from utils import OrderedSet, Struct, if_, mean, update, vector_add
 import random
 import copy
 import collections
+import contextlib
+import importlib.util
+import signal
+import threading
+import time
+
+# numpy is imported by the dense grid code only: it takes most of the
+# cold start of the core, which object-mode maps can do without
+HAVE_NUMPY = importlib.util.find_spec('numpy') is not None
 
 #______________________________________________________________________________
 
@@ -98,7 +107,8 @@ class Agent(Thing):
 
 def TraceAgent(agent):
     """Wrap the agent's program to print its input and output. This will let
-    you see what the agent is doing in the environment."""
+    you see what the agent is doing in the environment.  For long runs,
+    tracefile.TraceRecorder keeps the same information in a binary file."""
     old_program = agent.program
 
     def new_program(*percept):
@@ -108,6 +118,75 @@ def TraceAgent(agent):
     agent.program = new_program
     return agent
 
+
+class AgentTimeout(BaseException):
+
+    """Raised inside an agent program that overran its time budget.
+    It is not an Exception, so a bare 'except Exception' in the agent
+    does not swallow it."""
+
+
+@contextlib.contextmanager
+def time_limit(seconds):
+    """Interrupt the block with AgentTimeout after seconds of wall-clock
+    time.  Needs SIGALRM and the main thread; elsewhere it does nothing
+    and yields False."""
+    if seconds is None or not hasattr(signal, 'setitimer') or \
+            threading.current_thread() is not threading.main_thread():
+        yield False
+        return
+
+    def handler(signum, frame):
+        raise AgentTimeout()
+    old_handler = signal.signal(signal.SIGALRM, handler)
+    signal.setitimer(signal.ITIMER_REAL, max(seconds, 1e-6))
+    try:
+        yield True
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, old_handler)
+
+
+def BudgetAgent(agent, call_budget=None, episode_budget=None, penalty=10):
+    """Wrap the agent's program so that one call may last at most
+    call_budget seconds and all the calls of the episode together may use
+    at most episode_budget seconds of CPU time.  A call that overruns is
+    interrupted where SIGALRM is available (otherwise its action is
+    dropped once it returns) and counts as a 'NoOp' that costs penalty
+    points; agent.timeouts counts them.  Once the episode budget is spent
+    the program is not called anymore and the agent just does 'NoOp'.
+    Agents that must be stopped on any platform can be run out of process
+    with the same budgets."""
+    old_program = agent.program
+    agent.timeouts = 0
+    agent.cpu_time = 0.0
+
+    def new_program(*percept):
+        limit = call_budget
+        if episode_budget is not None:
+            remaining = episode_budget - agent.cpu_time
+            if remaining <= 0:
+                return 'NoOp'
+            limit = remaining if limit is None else min(limit, remaining)
+        timed_out = False
+        start, cpu_start = time.time(), time.process_time()
+        try:
+            with time_limit(limit) as armed:
+                action = old_program(*percept)
+            if not armed and limit is not None:
+                timed_out = time.time() - start > limit
+        except AgentTimeout:
+            timed_out = True
+        finally:
+            agent.cpu_time += time.process_time() - cpu_start
+        if timed_out:
+            agent.timeouts += 1
+            agent.performance -= penalty
+            return 'NoOp'
+        return action
+    agent.program = new_program
+    return agent
+
 #______________________________________________________________________________
 
 
@@ -229,11 +308,12 @@ class Environment(object):
     The environment keeps a list of .things and .agents (which is a subset
     of .things). Each agent has a .performance slot, initialized to 0.
     Each thing has a .location slot, even though some environments may not
-    need this."""
+    need this.  Both lists are OrderedSets, so adding and deleting a thing
+    is O(1) and iteration stays in insertion order."""
 
     def __init__(self):
-        self.things = []
-        self.agents = []
+        self.things = OrderedSet()
+        self.agents = OrderedSet()
 
     def thing_classes(self):
         return []  # List of classes that can go into environment
@@ -258,17 +338,61 @@ class Environment(object):
         "By default, we're done when we can't find a live agent."
         return not any(agent.is_alive() for agent in self.agents)
 
+    profilers = ()   # profiling.StepProfiler and the like, when attached
+    recorder = None  # A tracefile.TraceRecorder, when attached
+    clock = time.perf_counter  # Clock of the step timings
+
     def step(self):
         """Run the environment for one time step. If the
         actions and exogenous changes are independent, this method will
         do.  If there are interactions between them, you'll need to
-        override this method."""
+        override this method.
+
+        With profilers attached every phase is timed and each profiler's
+        record_step(env, timings) gets the (phase, agent or None, start,
+        end) timings of the step; otherwise nothing is timed."""
         if not self.is_done():
-            actions = [agent.program(*self.percept(agent))
-                       for agent in self.agents]
+            timings = [] if self.profilers else None
+            if timings is not None:
+                clock = self.clock
+                step_start = clock()
+            percepts = []
+            for agent in self.agents:
+                if timings is not None:
+                    start = clock()
+                percepts.append(self.percept(agent))
+                if timings is not None:
+                    timings.append(('percept', agent, start, clock()))
+            # Agents that think elsewhere (sandbox.SandboxedAgent) get
+            # all their percepts before any action is awaited
+            for (agent, percept) in zip(self.agents, percepts):
+                if hasattr(agent, 'start_program'):
+                    agent.start_program(*percept)
+            actions = []
+            for (agent, percept) in zip(self.agents, percepts):
+                if timings is not None:
+                    start = clock()
+                actions.append(agent.program(*percept))
+                if timings is not None:
+                    timings.append(('program', agent, start, clock()))
             for (agent, action) in zip(self.agents, actions):
+                if timings is not None:
+                    start = clock()
                 self.execute_action(agent, action)
+                if timings is not None:
+                    timings.append(('execute_action', agent, start, clock()))
+            if self.recorder is not None:
+                self.recorder.record(self, percepts, actions)
+            if timings is None:
+                self.exogenous_change()
+                return
+            start = clock()
             self.exogenous_change()
+            end = clock()
+            timings.append(('exogenous_change', None, start, end))
+            timings.append(('step', None, step_start, end))
+            for profiler in self.profilers:
+                profiler.record_step(self, timings)
 
     def run(self, steps=1000):
         "Run the Environment for given number of time steps."
@@ -325,19 +449,65 @@ class XYEnvironment(Environment):
     Agents perceive things within a radius.  Each agent in the
     environment has a .location slot which should be a location such
     as (0, 1), and a .holding slot, which should be a list of things
-    that are held."""
+    that are held.
+
+    Besides the .things list, the environment keeps two indexes that
+    add_thing, delete_thing and move_to hold in sync: .cells maps a
+    location to the things standing there, and .buckets maps a class
+    to its instances.  Lookups by location never scan .things."""
 
     def __init__(self, width=10, height=10):
         super(XYEnvironment, self).__init__()
-        update(self, width=width, height=height, observers=[])
+        update(self, width=width, height=height, observers=[],
+               cells={}, buckets={})
+
+    def index_thing(self, thing):
+        "Register thing in the location and class indexes."
+        self.cells.setdefault(thing.location, []).append(thing)
+        self.buckets.setdefault(thing.__class__, OrderedSet()).append(thing)
+
+    def unindex_thing(self, thing):
+        "Remove thing from the location and class indexes, if present."
+        for index, key in ((self.cells, thing.location),
+                           (self.buckets, thing.__class__)):
+            bucket = index.get(key)
+            if bucket is not None and thing in bucket:
+                bucket.remove(thing)
+                if not bucket:
+                    del index[key]
+
+    def list_things_at(self, location, tclass=Thing):
+        "Return all things exactly at a given location."
+        return [thing for thing in self.cells.get(location, ())
+                if isinstance(thing, tclass)]
+
+    def some_things_at(self, location, tclass=Thing):
+        """Return true if at least one of the things at location
+        is an instance of class tclass (or a subclass)."""
+        for thing in self.cells.get(location, ()):
+            if isinstance(thing, tclass):
+                return True
+        return False
+
+    def list_things(self, tclass=Thing):
+        "Return all things that are instances of tclass, grouped by class."
+        return [thing for cls, bucket in list(self.buckets.items())
+                if issubclass(cls, tclass) for thing in bucket]
 
     def things_near(self, location, radius=None):
-        "Return all things within radius of location."
+        """Return all things within radius of location.  Only the cells
+        inside the bounding square of the radius are visited."""
         if radius is None:
             radius = self.perceptible_distance
         radius2 = radius * radius
-        return [thing for thing in self.things
-                if distance2(location, thing.location) <= radius2]
+        x, y = location
+        r = int(radius)
+        near = []
+        for dx in range(-r, r + 1):
+            for dy in range(-r, r + 1):
+                if dx * dx + dy * dy <= radius2:
+                    near.extend(self.cells.get((x + dx, y + dy), ()))
+        return near
 
     perceptible_distance = 1
 
@@ -369,22 +539,24 @@ class XYEnvironment(Environment):
 
         while is_wall:
             loc = (random.choice(range(self.width)), random.choice(range(self.height)))
-            is_wall = False
-            for thing in self.things_near(loc, 1):
-                if isinstance(thing, Wall) and thing.location == loc:
-                    is_wall = True
+            is_wall = self.some_things_at(loc, Wall)
         return loc
 
     def move_to(self, thing, destination):
         "Move a thing to a new location."
         thing.bump = self.some_things_at(destination, Obstacle)
         if not thing.bump:
+            self.unindex_thing(thing)
             thing.location = destination
+            self.index_thing(thing)
             for o in self.observers:
                 o.thing_moved(thing)
 
     def add_thing(self, thing, location=(1, 1)):
+        if not isinstance(thing, Thing):
+            thing = Agent(thing)
         super(XYEnvironment, self).add_thing(thing, location)
+        self.index_thing(thing)
         thing.holding = []
         thing.held = None
         for obs in self.observers:
@@ -392,6 +564,7 @@ class XYEnvironment(Environment):
 
     def delete_thing(self, thing):
         super(XYEnvironment, self).delete_thing(thing)
+        self.unindex_thing(thing)
         # Any more to do?  Thing holding anything or being held?
         for obs in self.observers:
             obs.thing_deleted(thing)
@@ -419,6 +592,50 @@ class XYEnvironment(Environment):
             self.add_thing(Wall(), (0, y))
             self.add_thing(Wall(), (self.width, y))
 
+    def clear(self):
+        "Remove every thing at once, without telling the observers."
+        self.things = OrderedSet()
+        self.agents = OrderedSet()
+        self.cells = {}
+        self.buckets = {}
+
+    def snapshot(self, skip=()):
+        """Return the state of the environment as plain data: its size,
+        a (class, location) record per thing that is not an agent or an
+        instance of one of the skip classes, and an (agent, location,
+        performance, bump) record per agent.  Agents are kept by
+        reference: a snapshot puts them back where they stood with their
+        score, it does not save their program's internal state."""
+        things = [(cls, thing.location)
+                  for cls, bucket in self.buckets.items()
+                  if cls not in skip and not issubclass(cls, Agent)
+                  for thing in bucket]
+        agents = [(agent, agent.location, agent.performance, agent.bump)
+                  for agent in self.agents]
+        return Struct(width=self.width, height=self.height,
+                      things=things, agents=agents)
+
+    def restore(self, snapshot):
+        """Reset the environment to a snapshot, in time linear in the
+        number of things and without any deep copy."""
+        self.clear()
+        for cls, location in snapshot.things:
+            self.add_thing(cls(), location)
+        for agent, location, performance, bump in snapshot.agents:
+            self.add_thing(agent, location)
+            agent.performance = performance
+            agent.bump = bump
+
+    @classmethod
+    def from_snapshot(cls, snapshot):
+        """Return a new environment of this class set to a snapshot.
+        The subclass __init__ is not run: the snapshot already holds
+        everything it built."""
+        env = cls.__new__(cls)
+        XYEnvironment.__init__(env, snapshot.width, snapshot.height)
+        env.restore(snapshot)
+        return env
+
     def add_observer(self, observer):
         """Adds an observer to the list of observers.
         An observer is typically an EnvGUI.
@@ -464,22 +681,334 @@ REVERT = {
     "Dirt": Clean
 }
 
+# Tile codes of the dense (numpy.uint8) vacuum grid
+EMPTY, WALL, DIRT, CLEAN = 0, 1, 2, 3
+
+TILES = {
+    Wall: WALL,
+    Dirt: DIRT,
+    Clean: CLEAN
+}
+
+TILE_CLASSES = dict((code, cls) for cls, code in TILES.items())
+
+# What a dense cell shows when tiles share it: a wall wins over dirt,
+# and dirt over clean, as in VacuumEnvironment.to_grid
+TILE_RANK = {EMPTY: 0, CLEAN: 1, DIRT: 2, WALL: 3}
+
+# Characters of the text maps (init_env, load_rows and mapfile.py)
+TILE_CHARS = {
+    'W': Wall,
+    'D': Dirt,
+    'C': Clean
+}
+
+ROW_CODES = bytes.maketrans(b'WDC. ', bytes([WALL, DIRT, CLEAN, EMPTY, EMPTY]))
+
+# Action codes of the compact (array and trace) vacuum representations;
+# OTHER stands for any action the environment does not know.
+NOOP, SUCK, GO_NORTH, GO_SOUTH, GO_EAST, GO_WEST, OTHER = range(7)
+
+ACTION_CODES = {
+    'NoOp': NOOP,
+    'Noop': NOOP,
+    'Suck': SUCK,
+    'GoNorth': GO_NORTH,
+    'GoSouth': GO_SOUTH,
+    'GoEast': GO_EAST,
+    'GoWest': GO_WEST
+}
+
+ACTION_NAMES = ['NoOp', 'Suck', 'GoNorth', 'GoSouth', 'GoEast', 'GoWest',
+                None]
+
+
+class GridThings(object):
+
+    """The .things of a dense VacuumEnvironment.  Walls, dirt and clean
+    tiles live in env.grid and are turned into Thing objects only when
+    somebody asks for them; every other thing (the agents) is kept in
+    an OrderedSet.  Supports the list operations Environment uses:
+    iteration, len, in, append and remove."""
+
+    def __init__(self, env):
+        self.env = env
+        self.others = OrderedSet()
+        self.tiles = {}
+
+    def tile(self, location):
+        "Return the (cached) Thing for the tile at location, or None."
+        code = self.env.tile_at(location)
+        if code == EMPTY:
+            return None
+        thing = self.tiles.get(location)
+        if thing is None or thing.__class__ is not TILE_CLASSES[code]:
+            thing = TILE_CLASSES[code]()
+            thing.location = location
+            self.tiles[location] = thing
+        return thing
+
+    def __iter__(self):
+        import numpy as np
+        xs, ys = np.nonzero(self.env.grid)
+        for location in zip(xs.tolist(), ys.tolist()):
+            yield self.tile(location)
+        for thing in list(self.others):
+            yield thing
+
+    def __len__(self):
+        import numpy as np
+        return int(np.count_nonzero(self.env.grid)) + len(self.others)
+
+    def __contains__(self, thing):
+        if thing.__class__ in TILES:
+            return self.tiles.get(getattr(thing, 'location', None)) is thing
+        return thing in self.others
+
+    def append(self, thing):
+        self.others.append(thing)
+
+    def remove(self, thing):
+        self.others.remove(thing)
+
+
+# Snapshots of the environments built by VacuumEnvironment.template
+TEMPLATES = {}
+
 
 class VacuumEnvironment(XYEnvironment):
 
     """The environment of [Ex. 2.12]. Agent perceives dirty or clean,
     and bump (into obstacle) or not; 2D discrete world of unknown size;
     performance measure is 100 for each dirt cleaned, and -1 for
-    each turn taken."""
+    each turn taken.
 
-    def __init__(self, width=10, height=10):
+    With dense=True (or a subclass setting the dense class attribute)
+    walls, dirt and clean tiles are stored as one byte each in .grid,
+    a numpy.uint8 array of shape (width + 1, height + 1) holding the
+    EMPTY/WALL/DIRT/CLEAN codes.  Only the agents are kept as objects;
+    .things builds tile objects on demand (see GridThings)."""
+
+    dense = False
+
+    def __init__(self, width=10, height=10, dense=None):
         super(VacuumEnvironment, self).__init__(width, height)
         self.start_from = (1, 1)
+        self.roster = None
+        self.grid = None
+        if dense is None:
+            dense = self.dense
+        if dense:
+            if not HAVE_NUMPY:
+                raise ImportError("A dense VacuumEnvironment requires numpy")
+            import numpy as np
+            self.grid = np.zeros((width + 1, height + 1), dtype=np.uint8)
+            self.things = GridThings(self)
+
+    def load_grid(self, grid):
+        """Add the tiles of a uint8 array of tile codes, shaped like
+        (width + 1, height + 1).  A dense environment copies the array
+        in one go; otherwise one Thing is added per non-empty cell."""
+        import numpy as np
+        if self.grid is not None:
+            np.copyto(self.grid, grid)
+            self.things.tiles.clear()
+            return
+        for code, cls in sorted(TILE_CLASSES.items()):
+            xs, ys = np.nonzero(grid == code)
+            for location in zip(xs.tolist(), ys.tolist()):
+                self.add_thing(cls(), location)
+
+    def clear(self):
+        super(VacuumEnvironment, self).clear()
+        self.roster = None
+        if self.grid is not None:
+            self.grid[...] = EMPTY
+            self.things = GridThings(self)
+
+    def snapshot(self):
+        """Return the state of the environment (see XYEnvironment.snapshot).
+        A dense environment keeps its tiles as a copy of the grid; in
+        object mode they are (class, location) records like the other
+        things, and grid is None."""
+        if self.grid is not None:
+            snapshot = super(VacuumEnvironment, self).snapshot(
+                skip=tuple(TILES))
+            grid = self.grid.copy()
+        else:
+            snapshot = super(VacuumEnvironment, self).snapshot()
+            grid = None
+        update(snapshot, grid=grid, dense=self.grid is not None,
+               start_from=self.start_from)
+        return snapshot
+
+    def restore(self, snapshot):
+        super(VacuumEnvironment, self).restore(snapshot)
+        if snapshot.grid is not None:
+            self.load_grid(snapshot.grid)
+        self.start_from = snapshot.start_from
+
+    @classmethod
+    def from_snapshot(cls, snapshot):
+        env = cls.__new__(cls)
+        VacuumEnvironment.__init__(env, snapshot.width, snapshot.height,
+                                   dense=snapshot.dense)
+        env.restore(snapshot)
+        return env
+
+    @classmethod
+    def template(cls, *args, **kwargs):
+        """Return the snapshot of a new cls(*args, **kwargs), built the
+        first time and then cached by class, arguments and dense mode.
+        The template is shared: its grid is read-only and it must not
+        be changed."""
+        key = (cls, cls.dense, args, tuple(sorted(kwargs.items())))
+        snapshot = TEMPLATES.get(key)
+        if snapshot is None:
+            snapshot = cls(*args, **kwargs).snapshot()
+            if snapshot.grid is not None:
+                snapshot.grid.setflags(write=False)
+            TEMPLATES[key] = snapshot
+        return snapshot
+
+    @classmethod
+    def stamp(cls, *args, **kwargs):
+        """Return a new environment equal to cls(*args, **kwargs), copied
+        from its template instead of being built again: a dense one is
+        a single array copy."""
+        return cls.from_snapshot(cls.template(*args, **kwargs))
+
+    def tile_at(self, location):
+        "Return the tile code of the dense grid at location."
+        x, y = location
+        if 0 <= x < self.grid.shape[0] and 0 <= y < self.grid.shape[1]:
+            return int(self.grid[x, y])
+        return EMPTY
+
+    def set_tile(self, location, code):
+        "Write a tile code to the dense grid at location."
+        x, y = location
+        if not (0 <= x < self.grid.shape[0] and 0 <= y < self.grid.shape[1]):
+            raise IndexError("%s is outside the grid" % (location,))
+        self.grid[x, y] = code
+        self.things.tiles.pop(location, None)
+
+    def to_grid(self):
+        """Return a new numpy.uint8 array of the tile codes, in either mode.
+        A wall wins over dirt, and dirt over clean, on a shared cell."""
+        import numpy as np
+        if self.grid is not None:
+            return self.grid.copy()
+        grid = np.zeros((self.width + 1, self.height + 1), dtype=np.uint8)
+        for cls in (Clean, Dirt, Wall):
+            for thing in self.list_things(cls):
+                if thing.__class__ in TILES:
+                    grid[thing.location] = TILES[thing.__class__]
+        return grid
+
+    def list_things_at(self, location, tclass=Thing):
+        things = super(VacuumEnvironment, self).list_things_at(location, tclass)
+        if self.grid is not None:
+            tile = self.things.tile(location)
+            if tile is not None and isinstance(tile, tclass):
+                things.insert(0, tile)
+        return things
+
+    def some_things_at(self, location, tclass=Thing):
+        if self.grid is not None:
+            code = self.tile_at(location)
+            if code != EMPTY and issubclass(TILE_CLASSES[code], tclass):
+                return True
+        return super(VacuumEnvironment, self).some_things_at(location, tclass)
+
+    def list_things(self, tclass=Thing):
+        things = super(VacuumEnvironment, self).list_things(tclass)
+        if self.grid is not None:
+            import numpy as np
+            for code, cls in sorted(TILE_CLASSES.items()):
+                if issubclass(cls, tclass):
+                    xs, ys = np.nonzero(self.grid == code)
+                    things.extend(self.things.tile(location)
+                                  for location in zip(xs.tolist(), ys.tolist()))
+        return things
+
+    def things_near(self, location, radius=None):
+        things = super(VacuumEnvironment, self).things_near(location, radius)
+        if self.grid is not None:
+            if radius is None:
+                radius = self.perceptible_distance
+            x, y = location
+            r = int(radius)
+            for dx in range(-r, r + 1):
+                for dy in range(-r, r + 1):
+                    if dx * dx + dy * dy <= radius * radius:
+                        tile = self.things.tile((x + dx, y + dy))
+                        if tile is not None:
+                            things.append(tile)
+        return things
+
+    def add_thing(self, thing, location=(1, 1)):
+        if self.grid is None or thing.__class__ not in TILES:
+            self.roster = None
+            return super(VacuumEnvironment, self).add_thing(thing, location)
+        thing.location = location or self.default_location(thing)
+        code = TILES[thing.__class__]
+        if TILE_RANK[self.tile_at(thing.location)] > TILE_RANK[code]:
+            return  # Hidden by the tile already there
+        self.set_tile(thing.location, code)
+        for obs in self.observers:
+            obs.thing_added(thing)
+
+    def delete_thing(self, thing):
+        if self.grid is None or thing.__class__ not in TILES:
+            self.roster = None
+            return super(VacuumEnvironment, self).delete_thing(thing)
+        if self.tile_at(thing.location) != TILES[thing.__class__]:
+            print("  in VacuumEnvironment delete_thing")
+            print("  Thing to be removed: %s at %s" % (thing, thing.location))
+            return
+        self.set_tile(thing.location, EMPTY)
+        if thing.__class__.__name__ in REVERT:
+            self.add_thing(REVERT[thing.__class__.__name__](), thing.location)
+        for obs in self.observers:
+            obs.thing_deleted(thing)
+
+    def move_to(self, thing, destination):
+        super(VacuumEnvironment, self).move_to(thing, destination)
+        self.roster = None
+
+    def step(self):
+        "Rebuild the neighbour roster once per step, then step as usual."
+        self.roster = None
+        super(VacuumEnvironment, self).step()
 
     def thing_classes(self):
         return [Wall, Dirt, ReflexVacuumAgent, RandomVacuumAgent,
                 TableDrivenVacuumAgent, ModelBasedVacuumAgent]
 
+    def neighbor_roster(self):
+        """Return (ids, locations) for all the agents: the (agent_id,
+        agent_type) string pairs sent in percepts, and their locations.
+        The roster is cached until the next step or until an agent is
+        added, deleted or moved."""
+        if self.roster is None:
+            ids = []
+            for cur_n_agent in self.agents:
+                agent_type = getattr(cur_n_agent, 'name',
+                                     cur_n_agent.__class__.__name__)
+                if getattr(cur_n_agent, 'id', None) is not None:
+                    id_ = ("{0}".format(cur_n_agent.id),
+                           "{0}".format(agent_type)
+                           )
+                else:
+                    id_ = ("{0}".format(id(cur_n_agent)),
+                           "{0}".format(agent_type)
+                           )
+                ids.append(id_)
+            locations = [agent.location for agent in self.agents]
+            self.roster = (ids, locations)
+        return self.roster
+
     def percept(self, agent):
         """The percept is a tuple of ('Dirty' or 'Clean', 'Bump' or 'None').
         Unlike the TrivialVacuumEnvironment, location is NOT perceived."""
@@ -487,31 +1016,21 @@ class VacuumEnvironment(XYEnvironment):
                      'Dirty', 'Clean')
         bump = if_(agent.bump, 'Bump', 'None')
 
-        neighbors = []
-
-        for cur_n_agent in [thing for thing in self.things
-                            if isinstance(thing, Agent)]:
-            loc = cur_n_agent.location
-            agent_type = getattr(cur_n_agent, 'name',
-                                 cur_n_agent.__class__.__name__)
-            if getattr(cur_n_agent, 'id', None) is not None:
-                id_ = ("{0}".format(cur_n_agent.id),
-                       "{0}".format(agent_type)
-                       )
-            else:
-                id_ = ("{0}".format(id(cur_n_agent)),
-                       "{0}".format(agent_type)
-                       )
-            neighbors.append((
-                id_,
-                (loc[0]-agent.location[0],
-                 loc[1]-agent.location[1]))
-            )
+        ids, locations = self.neighbor_roster()
+        x, y = agent.location
+        neighbors = [(id_, (loc[0] - x, loc[1] - y))
+                     for id_, loc in zip(ids, locations)]
 
         return status, bump, neighbors
 
     def execute_action(self, agent, action):
-        if action == 'Suck':
+        if action == 'Suck' and self.grid is not None and not self.observers:
+            if self.tile_at(agent.location) == DIRT:
+                agent.performance += 100
+                self.set_tile(agent.location, CLEAN)
+            else:
+                agent.performance -= 20
+        elif action == 'Suck':
             dirt_list = self.list_things_at(agent.location, Dirt)
             if dirt_list != []:
                 dirt = dirt_list[0]
@@ -523,20 +1042,52 @@ class VacuumEnvironment(XYEnvironment):
             super(VacuumEnvironment, self).execute_action(agent, action)
             agent.performance -= 5
 
+    def init_env(self, string):
+        self.load_rows(string.splitlines())
+
+    def load_rows(self, rows, y=0):
+        """Add the tiles of text rows (str or bytes), the first one at
+        line y: W for a wall, D for dirt, C for clean and '.' or a space
+        for nothing.  A dense environment translates each row into its
+        grid at once.  Return the line after the last row."""
+        for row in rows:
+            if not isinstance(row, bytes):
+                row = row.encode('ascii')
+            row = row.rstrip(b'\r\n')
+            if self.grid is not None:
+                import numpy as np
+                codes = np.frombuffer(row.translate(ROW_CODES), dtype=np.uint8)
+                if codes.size and codes.max() > CLEAN:
+                    raise ValueError("Unknown tile in map row %d: %r" % (y, row))
+                self.grid[:codes.size, y] = codes
+            else:
+                for x, char in enumerate(row.decode('ascii')):
+                    if char in TILE_CHARS:
+                        self.add_thing(TILE_CHARS[char](), (x, y))
+                    elif char not in '. ':
+                        raise ValueError("Unknown tile in map row %d: %r" % (y, row))
+            y += 1
+        if self.grid is not None:
+            self.things.tiles.clear()
+        return y
+
     def add_dirty(self, location):
         "Put Dirt in a given location of the grid."
         self.add_thing(Dirt(), location)
 
     def dirty_all(self):
         "Place Dirty Everywhere"
+        if self.grid is not None and not self.observers:
+            inner = self.grid[1:self.width, 1:self.height]
+            free = inner == EMPTY
+            for x, y in self.cells:
+                if 1 <= x < self.width and 1 <= y < self.height:
+                    free[x - 1, y - 1] = False
+            inner[free] = DIRT
+            return
         for y in range(1, self.height):
             for x in range(1, self.width):
-                something = False
-                for thing in self.things:
-                    if thing.location == (x, y):
-                        something = True
-                        break
-                if not something:
+                if not self.some_things_at((x, y)):
                     self.add_dirty((x, y))
 
 
@@ -619,10 +1170,17 @@ def compare_agents(EnvFactory, AgentFactories, n=10, steps=1000):
     Create n instances of the environment, and run each agent in copies of
     each one for steps. Return a list of (agent, average-score) tuples."""
     envs = [EnvFactory() for i in range(n)]
-    return [(A, test_agent(A, steps, copy.deepcopy(envs)))
+    return [(A, test_agent(A, steps, clone_envs(envs)))
             for A in AgentFactories]
 
 
+def clone_envs(envs):
+    """Return fresh copies of envs, made from snapshots when the
+    environment supports them and with copy.deepcopy otherwise."""
+    return [env.from_snapshot(env.snapshot()) if hasattr(env, 'snapshot')
+            else copy.deepcopy(env) for env in envs]
+
+
 def test_agent(AgentFactory, steps, envs):
     "Return the mean score of running an agent in each of the envs, for steps"
     def score(env):
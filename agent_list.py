@@ -1,32 +1,90 @@
 # -*- coding:utf-8 -*-
 
+"""Find the agents of agent_dir.
+
+An agent is a module of agent_dir defining a class named after the
+module followed by Class (DeepBump.py defines DeepBumpClass).  The
+modules are found by reading their source, not by importing them: the
+index keeps the mtime and agent class of every file and only reads the
+files that changed since the last call, so load_agents() takes about a
+millisecond however many agents there are.  A module is imported the
+first time its agent is made, and reloaded then if its file changed
+after the import (or if it was imported without load()).
+"""
+
+import os
+import re
 import sys
-import inspect
-import pkgutil
+import importlib
 if sys.version_info.major > 2:
     from importlib import reload
 
 import agent_dir
 
-__all__ = ["load_agents"]
+__all__ = ["load_agents", "LazyAgent"]
 
+AGENT_DIR = os.path.dirname(os.path.abspath(agent_dir.__file__))
+# The environment, and the example agent of the README
+SKIP = ('agents', 'Example')
 
+_INDEX = {}     # module name -> (mtime, class name or None)
+_LOADED = {}    # module name -> mtime of the file when it was imported
 
-def load_agents():
 
-    for importer, modname, ispkg in pkgutil.iter_modules(agent_dir.__path__):
-        if modname != 'agents':
-            reload(sys.modules['{0}.{1}'.format('agent_dir', modname)])
+class LazyAgent(object):
 
-    all_agents = {}
+    """Stand-in for the agent class of a module, which is imported the
+    first time an agent is made or load() is called.  Calling it makes
+    an agent, like calling the class."""
+
+    def __init__(self, modname, clsname, mtime):
+        self.modname = modname
+        self.__name__ = clsname
+        self.mtime = mtime
+
+    def load(self):
+        "Import (or reload, if its file changed) the module; return the class."
+        fullname = 'agent_dir.{0}'.format(self.modname)
+        module = sys.modules.get(fullname)
+        if module is None:
+            module = importlib.import_module(fullname)
+        elif _LOADED.get(self.modname) != self.mtime:
+            # Changed since, or imported elsewhere from an unknown version
+            module = reload(module)
+        _LOADED[self.modname] = self.mtime
+        cls = getattr(module, self.__name__)
+        if not issubclass(cls, agent_dir.Agent):
+            raise TypeError('{0} is not an Agent'.format(self.__name__))
+        return cls
 
-    for importer, modname, ispkg in pkgutil.iter_modules(agent_dir.__path__):
-        for name, obj in inspect.getmembers(
-                sys.modules['agent_dir.{0}'.format(modname)],
-                inspect.isclass):
-            if 'agent_dir.{0}'.format(modname) == obj.__module__ and\
-                    '{0}Class'.format(modname) == name and\
-                    issubclass(obj, agent_dir.Agent):
-                all_agents[modname] = obj
+    def __call__(self, *args, **kwargs):
+        return self.load()(*args, **kwargs)
 
+    def __repr__(self):
+        return 'LazyAgent({0!r})'.format(self.modname)
+
+
+def agent_class_name(path, modname):
+    "Return the agent class name defined in the file, or None."
+    pattern = r'^class\s+({0}Class)\b'.format(re.escape(modname))
+    with open(path, 'rb') as f:
+        match = re.search(pattern.encode('ascii'), f.read(), re.MULTILINE)
+    return match and match.group(1).decode('ascii')
+
+
+def load_agents():
+    """Return {module name: LazyAgent} for the agent modules of
+    agent_dir, reading again only the files changed since last time."""
+    all_agents = {}
+    for file_ in os.listdir(AGENT_DIR):
+        modname, ext = os.path.splitext(file_)
+        if ext != '.py' or modname.startswith('_') or modname in SKIP:
+            continue
+        path = os.path.join(AGENT_DIR, file_)
+        mtime = os.path.getmtime(path)
+        entry = _INDEX.get(modname)
+        if entry is None or entry[0] != mtime:
+            entry = _INDEX[modname] = (mtime, agent_class_name(path, modname))
+        if entry[1] is not None:
+            all_agents[modname] = LazyAgent(modname, entry[1], mtime)
     return all_agents
@@ -14,18 +14,28 @@ from kivy.uix.label import Label
 from kivy.uix.boxlayout import BoxLayout
 from kivy.uix.spinner import Spinner
 from kivy.uix.popup import Popup
-from kivy.uix.image import Image
 from kivy.app import App
 from kivy.clock import Clock
-from kivy.graphics import Color, Rectangle
 from functools import partial
 from agent_dir.agents import *
 import agent_list
 import env_list
+import tracefile
+from gridcanvas import QuadBatch, SpriteAtlas, load_textures
+from metrics import StepMetrics
+from simthread import SimThread
+from tileview import TileView
+from utils import lru_memoize
 from os import path
+import os
+import time
 
 ALL_AGENTS = agent_list.load_agents()
 ALL_MAPS = env_list.get_maps()
+# Set AIMA_TRACE to a file name (e.g. trace.bin) to record the first
+# TRACE_STEPS steps of every episode; read it with: python tracefile.py
+TRACE_FILE = os.environ.get("AIMA_TRACE")
+TRACE_STEPS = 100000
 
 
 def check_img(img_name):
@@ -33,19 +43,12 @@ def check_img(img_name):
     return path.isfile(path.join("agents_dir", path.join("img", img_name)))
 
 
-def memoize(func):
-    """Memoize decorator."""
-    memo = {}
+def sprite_name(img_path):
+    """Return the atlas sprite of an image file."""
+    return path.splitext(path.basename(img_path))[0]
 
-    def helper(*args):
-        """Helper function for memoize paradigm."""
-        if args not in memo:
-            memo[args] = func(*args)
-        return memo[args]
-    return helper
 
-
-@memoize
+@lru_memoize(maxsize=16)
 def gen_popup(type_, text, dismiss=True):
     """Generate a popup."""
     popup_layout = BoxLayout(orientation='vertical')
@@ -74,107 +77,213 @@ class AimaUI(App):
         self.agentB = "Agent B"
         self.agentBImgDef = "img/agent_2.png"
         self.agentBImg = None
-        self.wall_img = Image(source="img/wall.png")
-        self.trash_img = Image(source="img/trash.png")
+        self.textures = load_textures(["img", "agent_dir/img"])
+        self.atlas = None
+        self.batches = ()
         self.map = None
         self.running = False
         self.env = None
+        self.recorder = None
+        self.agent_A = None
+        self.agent_B = None
+        self.agent_imgs = {}
+        self.view = TileView()
+        self.tile_size = (0, 0)
+        self.layout = None
+        self.extent = (0, 0)
+        self.sim = None
+        self.turbo = False
+        self.metrics = StepMetrics()
+        self.stats = None
         self.counter_steps = 0
         self.initialized = False
 
     def __initialize_env(self):
         """Initialize aima environment."""
+        self.stop_sim()
+        if self.recorder is not None:
+            self.recorder.close()
+            self.recorder = None
         if self.env is not None:
+            self.view.detach()
             del self.env
             self.env = None
+        self.agent_A = None
+        self.agent_B = None
+        self.agent_imgs = {}
         if self.map is not None:
-            self.env = ALL_MAPS[self.map]()
+            self.env = ALL_MAPS[self.map].stamp()
         if self.agentA in ALL_AGENTS:
-            agent_A = TraceAgent(ALL_AGENTS[self.agentA]())
+            agent_A = ALL_AGENTS[self.agentA]()
             if agent_A.img is not None and check_img(agent_A.img):
-                self.agentAImg = Image(
-                    source=path.join("agents_dir", path.join("img", agent_A.img)))
+                self.agentAImg = path.join("agents_dir", path.join("img", agent_A.img))
             else:
-                self.agentAImg = Image(source=self.agentAImgDef)
+                self.agentAImg = self.agentAImgDef
             self.env.add_thing(agent_A, location=self.env.start_from)
+            self.agent_A = agent_A
+            self.agent_imgs[agent_A] = sprite_name(self.agentAImg)
         if self.agentB in ALL_AGENTS:
-            agent_B = TraceAgent(ALL_AGENTS[self.agentB]())
+            agent_B = ALL_AGENTS[self.agentB]()
             if agent_B.img is not None and check_img(agent_B.img):
-                self.agentBImg = Image(
-                    source=path.join("agents_dir", path.join("img", agent_B.img)))
+                self.agentBImg = path.join("agents_dir", path.join("img", agent_B.img))
             else:
-                self.agentBImg = Image(source=self.agentBImgDef)
+                self.agentBImg = self.agentBImgDef
             self.env.add_thing(agent_B, location=self.env.start_from)
+            self.agent_B = agent_B
+            self.agent_imgs[agent_B] = sprite_name(self.agentBImg)
+        if self.env is not None:
+            if TRACE_FILE:
+                self.recorder = tracefile.TraceRecorder(
+                    TRACE_FILE, self.map,
+                    max_steps=TRACE_STEPS).attach(self.env)
+            self.metrics.attach(self.env)
+        else:
+            self.metrics.detach()
 
     def get_scores(self):
         """Get agents' scores."""
         return ("ScoreA = {0:d}".format(self.scoreA),
                 "ScoreB = {0:d}".format(self.scoreB))
 
+    def build_atlas(self, wid):
+        """Pack the sprites in an atlas and create the batches of wid.
+        Needs the GL context, so it is done at the first draw."""
+        sprites = dict((name, [((1, 1, 1, 1), texture)])
+                       for name, texture in self.textures.items())
+        sprites['dirt'] = [((0.5, 0, 0, 1), None),
+                           ((1, 1, 1, 1), self.textures['trash'])]
+        sprites['clean'] = [((0.1, 0.5, 0.1, 1), None)]
+        self.atlas = SpriteAtlas(sprites)
+        self.batches = (QuadBatch(wid.canvas, self.atlas),
+                        QuadBatch(wid.canvas, self.atlas),
+                        QuadBatch(wid.canvas.after, self.atlas,
+                                  quads_per_mesh=16))
+
+    def clear_canvas(self, wid):
+        """Remove every tile and agent from the canvas."""
+        for batch in self.batches:
+            batch.clear()
+            batch.flush()
+        self.update_stats(wid)
+
+    def draw_changes(self, wid, full, tiles, agents):
+        """Draw changes as TileView.flush() returns them.  Everything
+        drawn is laid out again if the widget moved or was resized.  The
+        time it takes goes to the metrics."""
+        start = time.perf_counter()
+        if self.atlas is None:
+            self.build_atlas(wid)
+        walls_batch, tiles_batch, agents_batch = self.batches
+        layout = (tuple(wid.pos), tuple(wid.size))
+        if full:
+            self.clear_canvas(wid)
+            locations = list(tiles) + [location for location
+                                       in agents.values() if location]
+            self.extent = max(locations) if locations else (0, 0)
+        if full or layout != self.layout:
+            self.layout = layout
+            n_x, n_y = self.extent
+            self.tile_size = (wid.width / float(n_x + 1),
+                              wid.height / float(n_y + 1))
+            for batch in self.batches:
+                batch.layout(wid.pos, self.tile_size)
+
+        for location, tile in tiles.items():
+            walls_batch.discard(location)
+            tiles_batch.discard(location)
+            if tile is Wall:
+                walls_batch.set(location, location, 'wall')
+            elif tile is not None:
+                tiles_batch.set(location, location, tile.__name__.lower())
+        for agent, location in agents.items():
+            if location is None:
+                agents_batch.discard(agent)
+            elif agent in self.agent_imgs:
+                agents_batch.set(agent, location, self.agent_imgs[agent])
+        for batch in self.batches:
+            batch.flush()
+        self.metrics.record_frame(time.perf_counter() - start)
+        self.update_stats(wid)
+
+    def update_stats(self, wid):
+        """Show the live metrics in the corner of the map."""
+        self.stats.text = '\n'.join(self.metrics.report())
+        self.stats.texture_update()
+        self.stats.size = self.stats.texture_size
+        self.stats.pos = (wid.x + 8, wid.top - self.stats.height - 8)
+
+    def update_scores(self, labels, scores):
+        """Show the scores, a dict of agent to performance."""
+        labelA, labelB = labels
+        if self.agent_A in scores:
+            self.scoreA = scores[self.agent_A]
+            labelA.text = self.get_scores()[0]
+        if self.agent_B in scores:
+            self.scoreB = scores[self.agent_B]
+            labelB.text = self.get_scores()[1]
+
     def update_canvas(self, labels, wid, *largs):
-        """Update the canvas to respect the environment."""
-        wid.canvas.clear()
+        """Update the canvas to respect the environment.  Only the tiles
+        and agents that changed since the last update are redrawn, or
+        everything if the environment changed.  While a SimThread runs
+        the environment the canvas is only laid out again."""
         self.counter.text = str(self.counter_steps)
-        n_x, n_y = max([thing.location for thing in self.env.things])
-        tile_x = wid.width / float(n_x + 1)
-        tile_y = wid.height / float(n_y + 1)
-        labelA, labelB = labels
-        with wid.canvas:
-            for thing in [thing for thing in self.env.things
-                          if isinstance(thing, Dirt) or
-                          isinstance(thing, Clean)]:
-                pos_x, pos_y = thing.location
-                if isinstance(thing, Dirt):
-                    Color(0.5, 0, 0)
-                    Rectangle(
-                        pos=(
-                            pos_x * tile_x + wid.x,
-                            pos_y * tile_y + wid.y),
-                        size=(tile_x, tile_y))
-                    Color(1, 1, 1, 1)
-                    Rectangle(texture=self.trash_img.texture,
-                              pos=(
-                                  pos_x * tile_x + wid.x,
-                                  pos_y * tile_y + wid.y
-                              ),
-                              size=(tile_x, tile_y))
-                elif isinstance(thing, Clean):
-                    Color(0.1, 0.5, 0.1)
-                    Rectangle(
-                        pos=(
-                            pos_x * tile_x + wid.x,
-                            pos_y * tile_y + wid.y),
-                        size=(tile_x, tile_y))
-            for thing in [thing for thing in self.env.things
-                          if isinstance(thing, Wall)]:
-                pos_x, pos_y = thing.location
-                Color(1, 1, 1, 1)
-                Rectangle(texture=self.wall_img.texture,
-                          pos=(pos_x * tile_x + wid.x,
-                               pos_y * tile_y + wid.y),
-                          size=(tile_x, tile_y))
-            for thing in [thing for thing in self.env.things
-                          if isinstance(thing, ALL_AGENTS.get(self.agentA, Agent)) or
-                          isinstance(thing, ALL_AGENTS.get(self.agentB, Agent))]:
-                pos_x, pos_y = thing.location
-                if self.agentA in ALL_AGENTS and\
-                   isinstance(thing, ALL_AGENTS[self.agentA]):
-                    self.scoreA = thing.performance
-                    labelA.text = self.get_scores()[0]
-                    Color(1, 1, 1, 1)
-                    Rectangle(texture=self.agentAImg.texture,
-                              pos=(pos_x * tile_x + wid.x,
-                                   pos_y * tile_y + wid.y),
-                              size=(tile_x, tile_y))
-                if self.agentB in ALL_AGENTS and\
-                   isinstance(thing, ALL_AGENTS[self.agentB]):
-                    self.scoreB = thing.performance
-                    labelB.text = self.get_scores()[1]
-                    Color(1, 1, 1, 1)
-                    Rectangle(texture=self.agentBImg.texture,
-                              pos=(pos_x * tile_x + wid.x,
-                                   pos_y * tile_y + wid.y),
-                              size=(tile_x, tile_y))
+        if self.sim is not None:
+            self.draw_changes(wid, False, {}, {})
+            return
+        if self.env is None:
+            self.view.detach()
+            self.clear_canvas(wid)
+            return
+        self.update_scores(labels, dict((agent, agent.performance)
+                                        for agent in self.env.agents))
+        if self.env is not self.view.env:
+            self.view.attach(self.env)
+        self.draw_changes(wid, *self.view.flush())
+
+    def start_sim(self, labels, wid, steps=None):
+        """Run the environment in a SimThread, drawing its frames from
+        the frame clock."""
+        self.stop_sim()
+        if self.env is None:
+            return
+        self.sim = SimThread(self.env, steps, turbo=self.turbo,
+                             view=self.view)
+        self.sim.start()
+        Clock.schedule_interval(
+            partial(self.poll_sim, labels, wid, self.sim), 1 / 30.)
+
+    def stop_sim(self):
+        """Stop the SimThread, if any."""
+        if self.sim is not None:
+            self.sim.stop()
+            self.sim = None
+
+    def poll_sim(self, labels, wid, sim, *largs):
+        """Draw the latest frame of sim; unschedules itself once sim is
+        over."""
+        if sim is not self.sim:
+            return False
+        frame = sim.latest()
+        if frame is not None:
+            self.counter_steps = frame.step
+            self.counter.text = str(self.counter_steps)
+            self.update_scores(labels, frame.scores)
+            self.draw_changes(wid, frame.full, frame.tiles, frame.agents)
+        elif not sim.is_alive():
+            self.stop_sim()
+            self.running = False
+            self.counter_steps = 0
+            self.btn_100step.state = "normal"
+            self.btn_run.state = "normal"
+            if sim.error is not None:
+                gen_popup("Error!", sim.error).open()
+            return False
+
+    def set_turbo(self, button, state):
+        self.turbo = state == "down"
+        if self.sim is not None:
+            self.sim.turbo = self.turbo
 
     def load_env(self, labels, wid, *largs):
         """Load and prepare the environment."""
@@ -191,22 +300,6 @@ class AimaUI(App):
         self.initialized = True
         self.update_canvas(labels, wid)
 
-    def running_step(self, labels, wid, n_step=None, *largs):
-        """Run the program of the environment, called from run."""
-        if self.env is not None:
-            if n_step is not None:
-                if self.counter_steps == n_step:
-                    self.running = False
-                    self.btn_100step.state = "normal"
-                    self.counter_steps = 0
-                    return False
-                else:
-                    self.counter_steps += 1
-            if not self.running:
-                return False
-            self.env.step()
-            self.update_canvas(labels, wid)
-
     def btn_step(self, labels, wid, *largs):
         """Update the environment one step."""
         if not self.initialized:
@@ -218,7 +311,7 @@ class AimaUI(App):
             Clock.schedule_once(popup.dismiss, timeout=2)
             Clock.schedule_once(self.partial_reset, timeout=2)
             return
-        if self.env is not None:
+        if self.env is not None and self.sim is None:
             self.env.step()
             self.update_canvas(labels, wid)
 
@@ -235,7 +328,7 @@ class AimaUI(App):
             Clock.schedule_once(self.partial_reset, timeout=2)
         self.btn_100step.state = "down"
         self.running = True
-        Clock.schedule_interval(partial(function, labels, wid, 100), 1 / 30.)
+        function(labels, wid, 100)
 
     def btn_run(self, function, labels, wid, *largs):
         """Run a function for the update."""
@@ -250,7 +343,7 @@ class AimaUI(App):
             Clock.schedule_once(self.partial_reset, timeout=2)
         self.btn_run.state = "down"
         self.running = True
-        Clock.schedule_interval(partial(function, labels, wid), 1 / 30.)
+        function(labels, wid)
 
     def btn_stop(self, function, *largs):
         """Stop a specific fuction."""
@@ -266,7 +359,7 @@ class AimaUI(App):
         self.counter_steps = 0
         self.btn_run.state = "normal"
         self.btn_100step.state = "normal"
-        Clock.unschedule(function)
+        function()
 
     @staticmethod
     def reset_popup(popup, *largs):
@@ -286,12 +379,11 @@ class AimaUI(App):
         self.scoreA = 0
         self.scoreB = 0
         self.__initialize_env()
-        wid.canvas.clear()
+        self.clear_canvas(wid)
         labelA, labelB = labels
         labelA.text = self.get_scores()[0]
         labelB.text = self.get_scores()[1]
         reload(env_list)
-        reload(agent_list)
         global ALL_AGENTS
         global ALL_MAPS
         ALL_AGENTS = agent_list.load_agents()
@@ -355,6 +447,10 @@ class AimaUI(App):
         """Build the user interface."""
 
         wid = Widget()
+        # Live stats, drawn over the map
+        self.stats = Label(font_size='12sp', halign='left',
+                           color=(1, 1, 0.4, 1))
+        wid.add_widget(self.stats)
 
         self.counter = Label(text="0")
         labelA = Label(text=self.get_scores()[0])
@@ -398,19 +494,22 @@ class AimaUI(App):
 
         self.btn_100step = ToggleButton(text='100 Step >',
                                         on_press=partial(self.btn_100step,
-                                                         self.running_step,
+                                                         self.start_sim,
                                                          labels,
                                                          wid))
 
         self.btn_run = ToggleButton(
             text='Run >>', on_press=partial(self.btn_run,
-                                            self.running_step,
+                                            self.start_sim,
                                             labels,
                                             wid))
 
+        self.btn_turbo = ToggleButton(text='Turbo')
+        self.btn_turbo.bind(state=self.set_turbo)
+
         btn_stop = Button(text='Stop [ ]',
                           on_press=partial(self.btn_stop,
-                                           self.running_step))
+                                           self.stop_sim))
 
         self.partial_reset = partial(self.reset_all,
                                      labels,
@@ -438,6 +537,7 @@ class AimaUI(App):
         action_layout.add_widget(self.btn_100step)
         action_layout.add_widget(self.counter)
         action_layout.add_widget(self.btn_run)
+        action_layout.add_widget(self.btn_turbo)
         action_layout.add_widget(btn_stop)
         action_layout.add_widget(btn_reload)
         action_layout.add_widget(btn_reset)
@@ -18,17 +18,20 @@ from kivy.uix.splitter import Splitter
 from kivy.uix.image import Image
 from kivy.app import App
 from kivy.clock import Clock
-from kivy.graphics import Color, Rectangle
 from kivy.uix.behaviors import ToggleButtonBehavior
 from kivy.uix.popup import Popup
 
 from random import random as r
 from functools import partial
-from os import path, walk
+import time
 from agent_dir import *
 
 import agent_list
 import env_list
+from gridcanvas import QuadBatch, SpriteAtlas, load_textures
+from metrics import StepMetrics
+from simthread import SimThread
+from tileview import TileView
 
 
 def gen_popup(title, text, dismiss=True):
@@ -46,84 +49,114 @@ def gen_popup(title, text, dismiss=True):
 
 class Renderer(Widget):
 
+    """Draws an environment as three QuadBatches of one sprite atlas:
+    walls, dirt and clean tiles, and agents on top.  A TileView tells
+    draw() what changed since the last frame, and only those quads are
+    rewritten.  While a SimThread runs the environment, draw_frame()
+    takes its frames.  With metrics (a StepMetrics) set, the time of
+    every frame is recorded there."""
+
     def __init__(self):
         super(Renderer, self).__init__()
-        self._imgs = {}
+        self.metrics = None
+        self._textures = load_textures(['./img', './agent_dir/img'])
+        self._atlas = None
+        self._walls = self._tiles = self._agents = None
         self._tile_size = (0, 0)
-
-        self.add_images_from_folder(self._imgs, './img')
-        self.add_images_from_folder(self._imgs, './agent_dir/img')
-
-    def add_images_from_folder(self, container, folder):
-        images = {}
-
-        for root, dirs, files in walk(path.abspath(folder)):
-            for file_ in files:
-                name, ext = path.splitext(path.basename(file_))
-                if ext == '.png':
-                    images[name] = Image(source=path.join(root, file_))
-
-        container.update(images)
-
-    def real_pos(self, x, y):
-        return (self.x + x * self._tile_size[0],
-                self.y + y * self._tile_size[1])
-
-    def set_tile_size(self, env):
-        if env is not None:
-            n_x, n_y = max([thing.location for thing in env.things])
-            tile_x = self.width / float(n_x + 1)
-            tile_y = self.height / float(n_y + 1)
-            self._tile_size = (tile_x, tile_y)
+        self._extent = (0, 0)
+        self._layout = None
+        self._view = TileView()
+
+    @property
+    def view(self):
+        return self._view
+
+    def build_atlas(self):
+        """Pack the sprites in an atlas and create the batches.  Needs
+        the GL context, so it is done at the first draw."""
+        sprites = dict((name, [((1, 1, 1, 1), texture)])
+                       for name, texture in self._textures.items())
+        # Tile backgrounds are baked opaque, as blended on the black window
+        sprites['dirt'] = [((0.54, 0, 0, 1), None),
+                           ((1, 1, 1, 1), self._textures['trash'])]
+        sprites['clean'] = [((0, 0.54, 0, 1), None)]
+        self._atlas = SpriteAtlas(sprites)
+        self._walls = QuadBatch(self.canvas, self._atlas)
+        self._tiles = QuadBatch(self.canvas, self._atlas)
+        self._agents = QuadBatch(self.canvas.after, self._atlas,
+                                 quads_per_mesh=16)
+
+    def set_tile_size(self):
+        n_x, n_y = self._extent
+        tile_x = self.width / float(n_x + 1)
+        tile_y = self.height / float(n_y + 1)
+        self._tile_size = (tile_x, tile_y)
+        self._layout = (tuple(self.pos), tuple(self.size))
+        for batch in (self._walls, self._tiles, self._agents):
+            batch.layout(self.pos, self._tile_size)
 
     def clear(self):
-        self.canvas.clear()
+        "Empty the canvas; the next draw() draws everything."
+        self._clear_canvas()
+        self._view.full = True
+
+    def _clear_canvas(self):
+        if self._atlas is not None:
+            for batch in (self._walls, self._tiles, self._agents):
+                batch.clear()
+                batch.flush()
+
+    def apply(self, full, tiles, agents):
+        """Draw the changes: tiles maps locations to tile classes and
+        agents maps agents to locations, None meaning gone.  With full
+        they describe everything there is to draw.  If the widget moved
+        or was resized everything drawn is laid out again."""
+        start = time.perf_counter()
+        if self._atlas is None:
+            self.build_atlas()
+        if full:
+            self._clear_canvas()
+            locations = list(tiles) + [location for location
+                                       in agents.values() if location]
+            self._extent = max(locations) if locations else (0, 0)
+            self.set_tile_size()
+        elif self._layout != (tuple(self.pos), tuple(self.size)):
+            self.set_tile_size()
+        for location, tile in tiles.items():
+            self._walls.discard(location)
+            self._tiles.discard(location)
+            if tile is Wall:
+                self._walls.set(location, location, 'wall')
+            elif tile is not None:
+                self._tiles.set(location, location, tile.__name__.lower())
+        for agent, location in agents.items():
+            if location is None:
+                self._agents.discard(agent)
+            else:
+                self._agents.set(agent, location, agent.img if agent.img is not None else agent.id.lower())
+        for batch in (self._walls, self._tiles, self._agents):
+            batch.flush()
+        if self.metrics is not None:
+            self.metrics.record_frame(time.perf_counter() - start)
+
+    def refresh(self):
+        "Lay the canvas out again if the widget moved or was resized."
+        self.apply(False, {}, {})
 
     def draw(self, env):
-        self.clear()
-
-        if env is not None:
-            walls = []
-            dirts = []
-            cleans = []
-            agents = []
-
-            for thing in env.things:
-                if isinstance(thing, Wall):
-                    walls.append(thing)
-                elif isinstance(thing, Dirt):
-                    dirts.append(thing)
-                elif isinstance(thing, Clean):
-                    cleans.append(thing)
-                elif isinstance(thing, Agent):
-                    agents.append(thing)
-
-            with self.canvas:
-                for wall in walls:
-                    Rectangle(texture=self._imgs.get('wall').texture,
-                              pos=self.real_pos(*wall.location),
-                              size=self._tile_size)
-                for dirt in dirts:
-                    Color(0.9, 0, 0, 0.6)
-                    Rectangle(
-                        pos=self.real_pos(*dirt.location),
-                        size=self._tile_size)
-                    Color(1, 1, 1, 1)
-                    Rectangle(texture=self._imgs.get('trash').texture,
-                              pos=self.real_pos(*dirt.location),
-                              size=self._tile_size)
-                for clean in cleans:
-                    Color(0, 0.9, 0, 0.6)
-                    Rectangle(
-                        pos=self.real_pos(*clean.location),
-                        size=self._tile_size)
-                for agent in agents:
-                    Color(1, 1, 1, 1)
-                    Rectangle(
-                        texture=self._imgs.get(agent.img if agent.img is not None else agent.id.lower()).texture,
-                        pos=self.real_pos(*agent.location),
-                        size=self._tile_size)
+        """Bring the canvas up to date with env: everything when the env
+        changed, else only what changed since the last call."""
+        if env is None:
+            self._view.detach()
+            self._clear_canvas()
+            return
+        if env is not self._view.env:
+            self._view.attach(env)
+        self.apply(*self._view.flush())
 
+    def draw_frame(self, frame):
+        "Draw a frame published by a SimThread."
+        self.apply(frame.full, frame.tiles, frame.agents)
 
 
 class ToggleButton(ToggleButtonBehavior, Image):
@@ -149,6 +182,10 @@ class VacuumEnv(App):
         self._env = None
         self._step = 0
         self._100_steps_pressed = False
+        self._sim = None
+        self._turbo = False
+        self._metrics = StepMetrics()
+        self._label_stats = None
         self._agent_objs = {
             'agent_1': None,
             'agent_2': None,
@@ -160,19 +197,47 @@ class VacuumEnv(App):
         self._load_done = gen_popup("INFO", "All resources loaded", dismiss=True)
 
     def _resize_env(self, *largs):
-        self._wid.set_tile_size(self._env)
-        self._wid.draw(self._env)
+        self.redraw()
 
     def on_resize(self, window, width, height, *largs):
         Clock.schedule_once(self._resize_env)
 
     def splitter_on_release(self):
-        self._wid.set_tile_size(self._env)
-        self._wid.draw(self._env)
+        self.redraw()
 
     def splitter_on_press(self):
-        self._wid.set_tile_size(self._env)
-        self._wid.draw(self._env)
+        self.redraw()
+
+    def redraw(self):
+        """Draw the environment, or only lay the canvas out again while
+        a SimThread owns the environment."""
+        if self._sim is not None:
+            self._wid.refresh()
+        else:
+            self._wid.draw(self._env)
+
+    def stop_sim(self):
+        "Stop the background run, if any."
+        if self._sim is not None:
+            self._sim.stop()
+            self._sim = None
+            self._100_steps_pressed = False
+
+    def attach_metrics(self):
+        "Measure the current environment, if any."
+        if self._env is not None:
+            self._metrics.attach(self._env)
+        else:
+            self._metrics.detach()
+        self.update_stats()
+
+    def update_stats(self):
+        "Show the metrics in the corner of the map."
+        label = self._label_stats
+        label.text = '\n'.join(self._metrics.report())
+        label.texture_update()
+        label.size = label.texture_size
+        label.pos = (self._wid.x + 8, self._wid.top - label.height - 8)
 
     def load_agents_and_maps(self, spinner_list, spinner_map):
         self._loading.open()
@@ -187,10 +252,11 @@ class VacuumEnv(App):
         self._load_done.open()
 
     def select_map(self, t_btn_random, label_steps, instance, data, *largs):
+        self.stop_sim()
         self._wid.clear()
         self._env = self._maps.get(data, None)
         if self._env is not None:
-            self._env = self._env()
+            self._env = self._env.stamp()
             self._step = 0
             label_steps.text = '{0}'.format(self._step)
             for name, agent in self._agent_objs.items():
@@ -202,10 +268,11 @@ class VacuumEnv(App):
                     else:
                         self._env.add_thing(agent,
                                             location=self._env.start_from)
-        self._wid.set_tile_size(self._env)
         self._wid.draw(self._env)
+        self.attach_metrics()
 
     def select_agent(self, agent_id, t_btn_random, spinner, text, *largs):
+        self.stop_sim()
         if text in ['agent_1', 'agent_2', 'agent_3', 'agent_4']:
             spinner.text = agent_id
             if self._env is not None and self._agent_objs[agent_id] is not None:
@@ -226,7 +293,7 @@ class VacuumEnv(App):
         self._wid.draw(self._env)
 
     def step(self, *largs, **kwargs):
-        if self._env is not None:
+        if self._env is not None and self._sim is None:
             self._env.step()
             self._wid.draw(self._env)
             self._step += 1
@@ -234,27 +301,52 @@ class VacuumEnv(App):
             for id_, label in kwargs['label_agents'].items():
                 if self._agent_objs[id_] is not None:
                     label.text = "{0}".format(self._agent_objs[id_].performance)
+            self.update_stats()
 
     def evt_100_steps(self, steps, *largs, **kwargs):
-        if self._env is not None:
-            if not self._100_steps_pressed and steps == 100:
-                self._100_steps_pressed = True
-                kwargs['btn_100step'].state = 'down'
-                self.step(*largs, **kwargs)
-                Clock.schedule_once(partial(self.evt_100_steps, steps-1, *largs, **kwargs), 1. / 30.)
-            elif steps < 100:
-                if steps == 0:
-                    kwargs['btn_100step'].state = 'normal'
-                    self._100_steps_pressed = False
-                else:
-                    kwargs['btn_100step'].state = 'down'
-                    self.step(*largs, **kwargs)
-                    Clock.schedule_once(partial(self.evt_100_steps, steps-1, *largs, **kwargs), 1. / 30.)
+        """Run steps steps in a SimThread; the frame clock only draws."""
+        if self._env is not None and not self._100_steps_pressed:
+            self._100_steps_pressed = True
+            kwargs['btn_100step'].state = 'down'
+            self._sim = SimThread(self._env, steps, turbo=self._turbo,
+                                  view=self._wid.view)
+            self._sim.start()
+            Clock.schedule_interval(partial(self.poll_sim, self._sim,
+                                            self._step, *largs, **kwargs),
+                                    1. / 30.)
+
+    def poll_sim(self, sim, first_step, *largs, **kwargs):
+        """Draw the latest frame of sim; unschedules itself once sim is
+        over."""
+        if sim is not self._sim:
+            return False
+        frame = sim.latest()
+        if frame is not None:
+            self._wid.draw_frame(frame)
+            self._step = first_step + frame.step
+            kwargs['label_steps'].text = '{0}'.format(self._step)
+            for id_, label in kwargs['label_agents'].items():
+                agent = self._agent_objs[id_]
+                if agent in frame.scores:
+                    label.text = "{0}".format(frame.scores[agent])
+            self.update_stats()
+        elif not sim.is_alive():
+            self.stop_sim()
+            kwargs['btn_100step'].state = 'normal'
+            if sim.error is not None:
+                gen_popup("ERROR", sim.error).open()
+            return False
+
+    def set_turbo(self, instance, value):
+        self._turbo = value == 'down'
+        if self._sim is not None:
+            self._sim.turbo = self._turbo
 
     def evt_step(self, *largs, **kwargs):
         Clock.schedule_once(partial(self.step, *largs, **kwargs))
 
     def reset(self, spinn_map, t_btn_random, label_steps, spinn_agents, label_agents, *largs, **kwargs):
+        self.stop_sim()
         self._wid.clear()
         self._step = 0
         label_steps.text = '{0}'.format(self._step)
@@ -262,7 +354,7 @@ class VacuumEnv(App):
             label.text = '{0}'.format(self._step)
         self._env = self._maps.get(spinn_map.text, None)
         if self._env is not None:
-            self._env = self._env()
+            self._env = self._env.stamp()
             for spinner in spinn_agents:
                 if spinner.text not in ['agent_1', 'agent_2', 'agent_3', 'agent_4']:
                     self._agent_objs[spinner.id] = self._agents[spinner.text]()
@@ -273,11 +365,16 @@ class VacuumEnv(App):
                     else:
                         self._env.add_thing(self._agent_objs[spinner.id],
                                                 location=self._env.start_from)
-            self._wid.set_tile_size(self._env)
             self._wid.draw(self._env)
+        self.attach_metrics()
 
     def build(self):
         self._wid = Renderer()
+        self._wid.metrics = self._metrics
+        # Live stats, drawn over the map
+        self._label_stats = Label(font_size='12sp', halign='left',
+                                  color=(1, 1, 0.4, 1))
+        self._wid.add_widget(self._label_stats)
 
         ##
         # First row
@@ -301,6 +398,9 @@ class VacuumEnv(App):
         label_random_pos = Label(text='rand p', size=(100, 42), size_hint=(None, 1))
         t_btn_random = ToggleButton(size=(64, 42), size_hint=(None, 1))
 
+        label_turbo = Label(text='turbo', size=(100, 42), size_hint=(None, 1))
+        t_btn_turbo = ToggleButton(size=(64, 42), size_hint=(None, 1))
+
         btn_reset = Button(text='Reset')
 
         lay_splitter = BoxLayout(orientation='vertical')
@@ -363,6 +463,8 @@ class VacuumEnv(App):
         lay_actions.add_widget(spinn_map)
         lay_actions.add_widget(label_random_pos)
         lay_actions.add_widget(t_btn_random)
+        lay_actions.add_widget(label_turbo)
+        lay_actions.add_widget(t_btn_turbo)
         lay_actions.add_widget(btn_reset)
 
         lay_splitter.add_widget(lay_actions)
@@ -442,6 +544,7 @@ class VacuumEnv(App):
                                      ])
 
         spinn_map.bind(text=partial(self.select_map, t_btn_random, label_steps))
+        t_btn_turbo.bind(state=self.set_turbo)
         spinn_agent_01.bind(text = partial(self.select_agent, spinn_agent_01.id, t_btn_random,))
         spinn_agent_02.bind(text = partial(self.select_agent, spinn_agent_02.id, t_btn_random,))
         spinn_agent_03.bind(text = partial(self.select_agent, spinn_agent_03.id, t_btn_random,))
@@ -0,0 +1,253 @@
+"""Benchmarks of the environment hot paths.
+
+Micro benchmarks time one operation of a VacuumEnvironment at a time
+(percept, execute_action, list_things_at, dirty_all, add_thing plus
+delete_thing), in object mode and, with numpy, in dense mode.  Macro
+benchmarks play every map of env_list with every agent of agent_dir
+for a fixed number of steps.  Every benchmark is run repeat times and
+its best time kept, in seconds per operation (per step for the macro
+ones).  A macro benchmark whose agent raises an exception has no time
+and is listed under failed instead.
+
+    python bench.py                          # all, saved to bench.json
+    python bench.py --group micro --out new.json --compare bench.json
+
+With --compare the results are checked against a stored run: a
+benchmark slower than the baseline by more than threshold (15% by
+default) is flagged, as is one that failed, and the script exits with
+status 1.
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import platform
+import random
+import sys
+import time
+
+import agent_list
+import env_list
+from agent_dir.agents import HAVE_NUMPY, Agent, VacuumEnvironment, Wall
+
+__all__ = ["MICRO", "run_micro", "run_macro", "run_all", "compare"]
+
+clock = time.perf_counter
+
+ACTIONS = ['GoEast', 'GoNorth', 'Suck', 'GoWest', 'GoSouth', 'NoOp']
+
+
+def micro_env(dense, size=64, n_agents=2):
+    "A walled, dirty size x size world with n_agents idle agents."
+    env = VacuumEnvironment(size, size, dense=dense)
+    env.add_walls()
+    env.dirty_all()
+    for i in range(n_agents):
+        agent = Agent(lambda status, bump, neighbors: 'NoOp')
+        agent.id = 'agent_{0}'.format(i + 1)
+        env.add_thing(agent, (1 + i * size // (2 * n_agents), size // 2))
+    return env
+
+
+def bench_percept(dense, number):
+    env = micro_env(dense)
+    agent = env.agents[0]
+    start = clock()
+    for i in range(number):
+        env.percept(agent)
+    return clock() - start
+
+
+def bench_execute_action(dense, number):
+    env = micro_env(dense)
+    agent = env.agents[0]
+    actions = (ACTIONS * (number // len(ACTIONS) + 1))[:number]
+    start = clock()
+    for action in actions:
+        env.execute_action(agent, action)
+    return clock() - start
+
+
+def bench_list_things_at(dense, number):
+    env = micro_env(dense)
+    locations = [(x, y) for x in range(env.width) for y in range(env.height)]
+    locations = (locations * (number // len(locations) + 1))[:number]
+    start = clock()
+    for location in locations:
+        env.list_things_at(location)
+    return clock() - start
+
+
+def bench_dirty_all(dense, number):
+    envs = []
+    for i in range(number):
+        env = VacuumEnvironment(64, 64, dense=dense)
+        env.add_walls()
+        envs.append(env)
+    start = clock()
+    for env in envs:
+        env.dirty_all()
+    return clock() - start
+
+
+def bench_add_delete(dense, number):
+    # Walls, as deleting dirt leaves a clean tile behind
+    env = micro_env(dense)
+    walls = [Wall() for i in range(number)]
+    location = env.agents[0].location
+    start = clock()
+    for thing in walls:
+        env.add_thing(thing, location)
+        env.delete_thing(thing)
+    return clock() - start
+
+
+# name -> (function, operations per run)
+MICRO = {
+    'percept': (bench_percept, 20000),
+    'execute_action': (bench_execute_action, 20000),
+    'list_things_at': (bench_list_things_at, 20000),
+    'dirty_all': (bench_dirty_all, 20),
+    'add_delete_thing': (bench_add_delete, 10000),
+}
+
+
+def run_micro(repeat=5, names=None):
+    """Return {name: seconds per operation} of the micro benchmarks,
+    named like percept[dense]."""
+    results = {}
+    modes = ['object'] + (['dense'] if HAVE_NUMPY else [])
+    for name in sorted(names or MICRO):
+        function, number = MICRO[name]
+        for mode in modes:
+            best = min(function(mode == 'dense', number)
+                       for i in range(repeat))
+            results['{0}[{1}]'.format(name, mode)] = best / number
+    return results
+
+
+def play(map_class, agent_class, steps, seed=0):
+    """Play one agent on a map for at most steps steps; return (seconds,
+    steps done, error), error being None unless the agent raised an
+    exception.  The agent's output is discarded."""
+    random.seed(seed)
+    env = map_class.stamp()
+    agent = agent_class()
+    agent.id = 'agent_1'
+    env.add_thing(agent, env.start_from)
+    done = 0
+    error = None
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = clock()
+        try:
+            while done < steps and not env.is_done():
+                env.step()
+                done += 1
+        except Exception as e:
+            error = '{0}: {1}'.format(e.__class__.__name__, e)
+        elapsed = clock() - start
+    return elapsed, done, error
+
+
+def run_macro(steps=300, repeat=3, maps=None, agents=None):
+    """Return ({map/agent: seconds per step}, {map/agent: error}) of
+    every map and agent pair.  A pair whose agent raised an exception
+    gets no time, only its error."""
+    all_maps = env_list.get_maps()
+    all_agents = agent_list.load_agents()
+    results = {}
+    failed = {}
+    for map_name in sorted(maps or all_maps):
+        for agent_name in sorted(agents or all_agents):
+            name = '{0}/{1}'.format(map_name, agent_name)
+            best = None
+            for i in range(repeat):
+                elapsed, done, error = play(all_maps[map_name],
+                                            all_agents[agent_name], steps)
+                if error is not None:
+                    failed[name] = error
+                    break
+                if done:
+                    best = min(best or elapsed / done, elapsed / done)
+            if best is not None and name not in failed:
+                results[name] = best
+    return results, failed
+
+
+def run_all(groups=('micro', 'macro'), repeat=5, steps=300):
+    "Run the groups of benchmarks; return the report to save as JSON."
+    numpy = None
+    if HAVE_NUMPY:
+        import numpy
+    report = dict(python=platform.python_version(),
+                  numpy=numpy and numpy.__version__,
+                  machine=platform.machine(), node=platform.node(),
+                  created=time.strftime('%Y-%m-%dT%H:%M:%S'),
+                  micro={}, macro={}, failed={})
+    if 'micro' in groups:
+        report['micro'] = run_micro(repeat)
+    if 'macro' in groups:
+        report['macro'], report['failed'] = run_macro(steps,
+                                                      max(1, repeat // 2))
+    return report
+
+
+def compare(report, baseline, threshold=.15):
+    """Return rows (group, name, baseline, now, change) for the
+    benchmarks of both reports, and the names of the regressions: the
+    benchmarks slower by more than threshold, and those of the
+    baseline that failed now."""
+    rows = []
+    regressions = sorted(name for name in report.get('failed', {})
+                         if name in baseline.get('macro', {}))
+    for group in ('micro', 'macro'):
+        old, new = baseline.get(group, {}), report.get(group, {})
+        for name in sorted(set(old) & set(new)):
+            change = new[name] / old[name] - 1
+            if change > threshold:
+                regressions.append(name)
+            rows.append((group, name, old[name], new[name], change))
+    return rows, regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--group', choices=['micro', 'macro'],
+                        help='run only this group')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--steps', type=int, default=300,
+                        help='steps per macro benchmark')
+    parser.add_argument('--out', default='bench.json')
+    parser.add_argument('--compare', metavar='BASELINE',
+                        help='a report saved by a previous run')
+    parser.add_argument('--threshold', type=float, default=.15,
+                        help='slowdown flagged as a regression')
+    args = parser.parse_args(argv)
+
+    groups = [args.group] if args.group else ['micro', 'macro']
+    report = run_all(groups, args.repeat, args.steps)
+    with open(args.out, 'w') as f:
+        json.dump(report, f, indent=1, sort_keys=True)
+
+    for name, error in sorted(report['failed'].items()):
+        print('{0:<50} FAILED {1}'.format(name, error))
+    if not args.compare:
+        for group in groups:
+            for name, seconds in sorted(report[group].items()):
+                print('{0:<50} {1:>10.2f} us'.format(name, seconds * 1e6))
+        return 0
+    with open(args.compare) as f:
+        baseline = json.load(f)
+    rows, regressions = compare(report, baseline, args.threshold)
+    for group, name, old, new, change in rows:
+        print('{0:<50} {1:>10.2f} {2:>10.2f} us {3:>+7.1%}{4}'.format(
+            name, old * 1e6, new * 1e6, change,
+            '  SLOWER' if name in regressions else ''))
+    print('{0} regression(s) over {1:.0%}'.format(len(regressions),
+                                                  args.threshold))
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,93 @@
+"""Cold-start import time of the simulation core.
+
+Each module is imported in a fresh interpreter, the way a tournament
+worker starts, and the median time of the runs is compared with the
+budget of the module.  A module over its budget, or one pulling in
+Kivy or numpy, makes the script exit with status 1, so it can guard the import
+surface in a CI job:
+
+    python bench_import.py            # 15 runs per module
+    python bench_import.py --runs 50 --budget-scale 2
+
+The first run of a module is not counted: it may have to compile it.
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+from utils import print_table
+
+__all__ = ["import_time", "check", "BUDGETS"]
+
+# Module -> median cold import budget in milliseconds
+BUDGETS = [
+    ('utils', 10),
+    ('agent_dir', 20),
+    ('env_list', 25),
+    ('agent_list', 25),
+    ('tournament', 50),
+]
+
+# Modules the simulation core must not import when it is imported:
+# numpy alone would take about 40 ms, and only dense maps need it
+FORBIDDEN = ('kivy', 'numpy')
+
+PROBE = """
+import sys, time, json
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+print(json.dumps([elapsed, sorted(set(name.split('.')[0] for name in sys.modules))]))
+"""
+
+
+def import_time(module, cwd=None):
+    """Import module in a new interpreter; return (seconds, names of the
+    top-level packages loaded)."""
+    cwd = cwd or os.path.dirname(os.path.abspath(__file__))
+    output = subprocess.check_output(
+        [sys.executable, '-c', PROBE.format(module=module)], cwd=cwd)
+    elapsed, packages = json.loads(output.decode().splitlines()[-1])
+    return elapsed, packages
+
+
+def check(runs=15, budget_scale=1.):
+    """Time every module of BUDGETS; return the table rows and whether
+    all of them are within budget."""
+    rows = []
+    ok = True
+    for module, budget in BUDGETS:
+        import_time(module)
+        times = []
+        for run in range(runs):
+            elapsed, packages = import_time(module)
+            times.append(elapsed * 1e3)
+        times.sort()
+        middle = times[len(times) // 2]
+        budget *= budget_scale
+        forbidden = [name for name in FORBIDDEN if name in packages]
+        passed = middle <= budget and not forbidden
+        ok = ok and passed
+        rows.append([module, times[0], middle, budget,
+                     ', '.join(forbidden) or '-',
+                     'ok' if passed else 'OVER'])
+    return rows, ok
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--runs', type=int, default=15)
+    parser.add_argument('--budget-scale', type=float, default=1.,
+                        help='multiply every budget, for slow machines')
+    args = parser.parse_args(argv)
+    rows, ok = check(args.runs, args.budget_scale)
+    print_table(rows, header=['module', 'best ms', 'median ms', 'budget ms',
+                              'forbidden', ''], numfmt='%.1f')
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,9 +1,24 @@
-from agent_dir.agents import *
+import os
 
-__all__ = ["get_maps"]
+from agent_dir.agents import HAVE_NUMPY, VacuumEnvironment, Wall
+from mapfile import find_maps
+from mapgen import generated_maps
 
+__all__ = ["get_maps", "MAP_DIR"]
 
-class VacuumMap1(VacuumEnvironment):
+# Map files (see mapfile.py) found here are added to get_maps()
+MAP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "maps")
+
+
+class VacuumMap(VacuumEnvironment):
+
+    """The maps below keep their tiles in a dense grid when numpy is
+    there, so that stamp() copies the grid of their template at once."""
+
+    dense = HAVE_NUMPY
+
+
+class VacuumMap1(VacuumMap):
 
     def __init__(self):
         super(VacuumMap1, self).__init__(8, 8)
@@ -12,7 +27,7 @@ class VacuumMap1(VacuumEnvironment):
         self.start_from = (1, 2)
 
 
-class VacuumMap2(VacuumEnvironment):
+class VacuumMap2(VacuumMap):
 
     def __init__(self):
         super(VacuumMap2, self).__init__(8, 8)
@@ -21,7 +36,7 @@ class VacuumMap2(VacuumEnvironment):
         self.add_thing(Wall(), (3, 3))
         self.dirty_all()
 
-class VacuumMap3(VacuumEnvironment):
+class VacuumMap3(VacuumMap):
 
     def __init__(self):
         super(VacuumMap3, self).__init__(4, 4)
@@ -31,7 +46,7 @@ class VacuumMap3(VacuumEnvironment):
         self.dirty_all()
 
 
-class VacuumMap4(VacuumEnvironment):
+class VacuumMap4(VacuumMap):
 
     def __init__(self):
         super(VacuumMap4, self).__init__(10, 10)
@@ -47,7 +62,7 @@ class VacuumMap4(VacuumEnvironment):
         self.dirty_all()
 
 
-class VacuumMap5(VacuumEnvironment):
+class VacuumMap5(VacuumMap):
 
     def __init__(self):
         super(VacuumMap5, self).__init__(10, 10)
@@ -66,7 +81,7 @@ class VacuumMap5(VacuumEnvironment):
         self.dirty_all()
 
 
-class VacuumMap6(VacuumEnvironment):
+class VacuumMap6(VacuumMap):
 
     def __init__(self):
         super(VacuumMap6, self).__init__(8, 8)
@@ -81,7 +96,7 @@ WWWWWWWW""")
         self.start_from = (4, 4)
 
 
-class VacuumMap7(VacuumEnvironment):
+class VacuumMap7(VacuumMap):
 
     def __init__(self):
         super(VacuumMap7, self).__init__(8, 8)
@@ -123,7 +138,7 @@ class VacuumMap7(VacuumEnvironment):
         self.start_from = (3, 1)
 
 
-class VacuumMap8(VacuumEnvironment):
+class VacuumMap8(VacuumMap):
 
     def __init__(self):
         super(VacuumMap8, self).__init__(8, 8)
@@ -147,7 +162,7 @@ class VacuumMap8(VacuumEnvironment):
         self.dirty_all()
 
 
-class VacuumMap9(VacuumEnvironment):
+class VacuumMap9(VacuumMap):
 
     def __init__(self):
         super(VacuumMap9, self).__init__(9, 9)
@@ -182,7 +197,7 @@ class VacuumMap9(VacuumEnvironment):
 
 
 def get_maps():
-    return {
+    maps = {
         "VacuumMap1": VacuumMap1,
         "VacuumMap2": VacuumMap2,
         "VacuumMap3": VacuumMap3,
@@ -193,3 +208,6 @@ def get_maps():
         "VacuumMap8": VacuumMap8,
         "VacuumMap9": VacuumMap9
     }
+    maps.update(generated_maps())
+    maps.update(find_maps(MAP_DIR))
+    return maps
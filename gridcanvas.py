@@ -0,0 +1,171 @@
+"""Draw vacuum maps with a few meshes and a single texture.
+
+All the sprites (walls, dirt and clean tiles, agents) are packed into
+one atlas texture when the UI starts: each sprite is drawn into a cell
+of an Fbo, colored backgrounds included, so the dirt tile with its red
+background and trash image is one sprite.  Tiles and agents are then
+quads of a QuadBatch: every quad of a batch lives in a Mesh textured by
+the atlas, so a whole map is drawn by a handful of draw calls without a
+texture switch.
+
+Kivy indexes mesh vertices with 16 bits, so a batch spreads its quads
+over meshes of quads_per_mesh quads.  Changing a quad rewrites its 16
+floats in place and only the meshes that changed are uploaded again by
+flush(); a removed quad becomes an empty one, and its slot is reused.
+"""
+
+import math
+from array import array
+from os import path, walk
+
+from kivy.core.image import Image as CoreImage
+from kivy.graphics import (ClearBuffers, ClearColor, Color, Fbo,
+                           InstructionGroup, Mesh, Rectangle)
+
+__all__ = ["load_textures", "SpriteAtlas", "QuadBatch"]
+
+SPRITE_SIZE = 64
+
+
+def load_textures(folders):
+    "Return {name: texture} for the PNG files found under folders."
+    textures = {}
+    for folder in folders:
+        for root, dirs, files in walk(path.abspath(folder)):
+            for file_ in files:
+                name, ext = path.splitext(path.basename(file_))
+                if ext == '.png':
+                    textures[name] = CoreImage(path.join(root, file_)).texture
+    return textures
+
+
+class SpriteAtlas(object):
+
+    """sprites maps a name to its layers, (rgba, texture) pairs drawn one
+    over the other (texture None for a plain color).  Every sprite gets
+    a size x size cell of the atlas texture; regions[name] holds its
+    texture coordinates (u0, v0, u1, v1)."""
+
+    def __init__(self, sprites, size=SPRITE_SIZE):
+        names = sorted(sprites)
+        columns = int(math.ceil(math.sqrt(len(names)))) or 1
+        rows = int(math.ceil(len(names) / float(columns))) or 1
+        width, height = columns * size, rows * size
+        self.fbo = Fbo(size=(width, height))
+        self.regions = {}
+        with self.fbo:
+            ClearColor(0, 0, 0, 0)
+            ClearBuffers()
+            for index, name in enumerate(names):
+                x, y = (index % columns) * size, (index // columns) * size
+                for rgba, texture in sprites[name]:
+                    Color(*rgba)
+                    Rectangle(texture=texture, pos=(x, y), size=(size, size))
+                # Half a texel in, so filtering does not bleed neighbours
+                self.regions[name] = ((x + .5) / width, (y + .5) / height,
+                                      (x + size - .5) / width,
+                                      (y + size - .5) / height)
+        self.fbo.draw()
+        self.texture = self.fbo.texture
+
+    def __contains__(self, name):
+        return name in self.regions
+
+
+class QuadBatch(object):
+
+    """Sprites of an atlas drawn at grid locations.  Quads are set and
+    discarded by key; layout() places location (x, y) at origin + (x, y)
+    times tile_size.  Nothing is uploaded before flush()."""
+
+    def __init__(self, canvas, atlas, quads_per_mesh=2048):
+        self.atlas = atlas
+        self.quads_per_mesh = quads_per_mesh
+        self.origin = (0, 0)
+        self.tile_size = (0, 0)
+        self.quads = {}
+        self.free = []
+        self.size = 0
+        self.meshes = []
+        self.dirty = set()
+        self.group = InstructionGroup()
+        self.group.add(Color(1, 1, 1, 1))
+        canvas.add(self.group)
+
+    def layout(self, origin, tile_size):
+        "Move the grid, and every quad with it."
+        self.origin = tuple(origin)
+        self.tile_size = tuple(tile_size)
+        for slot, location, sprite in self.quads.values():
+            self.write(slot, location, sprite)
+
+    def set(self, key, location, sprite):
+        "Draw sprite at location as the quad of key."
+        entry = self.quads.get(key)
+        if entry is not None:
+            slot = entry[0]
+        elif self.free:
+            slot = self.free.pop()
+        else:
+            slot = self.new_slot()
+        self.quads[key] = (slot, location, sprite)
+        self.write(slot, location, sprite)
+
+    def discard(self, key):
+        "Remove the quad of key, if there is one."
+        entry = self.quads.pop(key, None)
+        if entry is not None:
+            self.write(entry[0], None, None)
+            self.free.append(entry[0])
+
+    def new_slot(self):
+        slot = self.size
+        self.size += 1
+        if slot == len(self.meshes) * self.quads_per_mesh:
+            quads = self.quads_per_mesh
+            vertices = array('f', [0.0]) * (16 * quads)
+            indices = array('H')
+            for quad in range(quads):
+                first = 4 * quad
+                indices.extend((first, first + 1, first + 2,
+                                first + 2, first + 3, first))
+            mesh = Mesh(vertices=vertices, indices=indices,
+                        mode='triangles', texture=self.atlas.texture)
+            self.group.add(mesh)
+            self.meshes.append((mesh, vertices))
+        return slot
+
+    def write(self, slot, location, sprite):
+        "Write the vertices of a quad; an empty one for location None."
+        chunk, offset = divmod(slot, self.quads_per_mesh)
+        vertices = self.meshes[chunk][1]
+        start = 16 * offset
+        if location is None:
+            vertices[start:start + 16] = array('f', [0.0]) * 16
+        else:
+            tile_x, tile_y = self.tile_size
+            x0 = self.origin[0] + location[0] * tile_x
+            y0 = self.origin[1] + location[1] * tile_y
+            x1, y1 = x0 + tile_x, y0 + tile_y
+            u0, v0, u1, v1 = self.atlas.regions[sprite]
+            vertices[start:start + 16] = array('f', (
+                x0, y0, u0, v0, x1, y0, u1, v0,
+                x1, y1, u1, v1, x0, y1, u0, v1))
+        self.dirty.add(chunk)
+
+    def flush(self):
+        "Upload the meshes changed since the last flush."
+        for chunk in self.dirty:
+            mesh, vertices = self.meshes[chunk]
+            mesh.vertices = vertices
+        self.dirty = set()
+
+    def clear(self):
+        "Remove every quad and mesh."
+        for mesh, vertices in self.meshes:
+            self.group.remove(mesh)
+        self.quads = {}
+        self.free = []
+        self.size = 0
+        self.meshes = []
+        self.dirty = set()
@@ -0,0 +1,162 @@
+"""Vacuum maps stored in files.
+
+Two formats are read and written.  A text map (.map) is a few optional
+header lines followed by one row per line, the first row at y = 0, with
+the characters of VacuumEnvironment.load_rows (blank lines are skipped,
+so an empty row is written with dots):
+
+    size 7 4
+    start 1 1
+    WWWWWWWW
+    WDDDDDDW
+    WDDWWDDW
+    WDDDDDDW
+    WWWWWWWW
+
+size is the width and height of the environment (the grid has one more
+column and row) and defaults to the extent of the rows; start is
+start_from.  A binary map (.vmap) is b'VMAP', a little-endian header
+(version, columns, rows, start x, start y), then the rows of tile codes
+packed four cells to a byte, two bits each, lowest bits first.
+
+Both are streamed into the dense grid of the environment, a chunk of
+rows at a time, without one object per cell.  find_maps() turns the
+map files of a directory into environment classes; env_list.get_maps()
+adds the ones of the maps directory next to it.
+
+    env = MapFile.stamp('maps/warehouse.vmap')
+    save_map(env, 'maps/copy.map')
+"""
+
+import os
+import struct
+
+from agent_dir.agents import HAVE_NUMPY, VacuumEnvironment
+
+__all__ = ["MapFile", "read_header", "save_map", "find_maps",
+           "MAP_EXTENSIONS"]
+
+MAGIC = b'VMAP'
+VERSION = 1
+HEADER = struct.Struct('<HIIii')
+MAP_EXTENSIONS = ('.map', '.vmap')
+CHUNK_ROWS = 256
+
+_CLASSES = {}
+
+
+def read_header(f, binary):
+    """Read the header of an open map file.  Return (columns, rows,
+    start, first_rows); rows is None when a text map has no size line,
+    and first_rows holds the map rows read while looking for it."""
+    if binary:
+        if f.read(4) != MAGIC:
+            raise ValueError("%s is not a binary map" % f.name)
+        version, columns, rows, x, y = HEADER.unpack(f.read(HEADER.size))
+        if version != VERSION:
+            raise ValueError("%s: unknown map version %d" % (f.name, version))
+        return columns, rows, (x, y), []
+    columns = rows = None
+    start = (1, 1)
+    for line in f:
+        words = line.split()
+        if words[:1] == [b'size']:
+            columns, rows = int(words[1]) + 1, int(words[2]) + 1
+        elif words[:1] == [b'start']:
+            start = (int(words[1]), int(words[2]))
+        elif words[:1] != [] and not line.startswith(b'#'):
+            return columns, rows, start, [line]
+    return columns, rows, start, []
+
+
+class MapFile(VacuumEnvironment):
+
+    """A dense environment read from a map file.  path defaults to the
+    class attribute of the same name, which find_maps() sets."""
+
+    dense = True
+    path = None
+
+    def __init__(self, path=None):
+        path = path or self.path
+        binary = path.endswith('.vmap')
+        with open(path, 'rb') as f:
+            columns, rows, start, first_rows = read_header(f, binary)
+            if rows is None:
+                # No size line: the rows have to be read to find it
+                first_rows = [line for line in first_rows + list(f)
+                              if line.strip()]
+                rows = len(first_rows)
+                columns = max(len(line.rstrip(b'\r\n'))
+                              for line in first_rows) if rows else 0
+            super(MapFile, self).__init__(max(columns - 1, 0),
+                                          max(rows - 1, 0), dense=True)
+            if binary:
+                self.load_packed(f, columns, rows)
+            else:
+                y = self.load_rows(first_rows)
+                self.load_rows((line for line in f if line.strip()), y)
+        self.start_from = start
+
+    def load_packed(self, f, columns, rows):
+        "Stream the packed rows of a binary map into the grid."
+        import numpy as np
+        row_bytes = (columns + 3) // 4
+        shifts = np.array([0, 2, 4, 6], dtype=np.uint8)
+        for y in range(0, rows, CHUNK_ROWS):
+            n_rows = min(CHUNK_ROWS, rows - y)
+            data = f.read(row_bytes * n_rows)
+            if len(data) != row_bytes * n_rows:
+                raise ValueError("%s: truncated map" % f.name)
+            packed = np.frombuffer(data, dtype=np.uint8)
+            codes = (packed.reshape(n_rows, row_bytes, 1) >> shifts) & 3
+            codes = codes.reshape(n_rows, row_bytes * 4)[:, :columns]
+            self.grid[:columns, y:y + n_rows] = codes.T
+        self.things.tiles.clear()
+
+
+def save_map(env, path):
+    """Write the tiles and start_from of a VacuumEnvironment as a text
+    map, or as a binary one if path ends with .vmap."""
+    import numpy as np
+    grid = env.to_grid()
+    columns, rows = grid.shape
+    start = tuple(getattr(env, 'start_from', (1, 1)))
+    with open(path, 'wb') as f:
+        if path.endswith('.vmap'):
+            f.write(MAGIC + HEADER.pack(VERSION, columns, rows,
+                                        start[0], start[1]))
+            row_bytes = (columns + 3) // 4
+            padded = np.zeros((rows, row_bytes * 4), dtype=np.uint8)
+            for y in range(0, rows, CHUNK_ROWS):
+                chunk = padded[:min(CHUNK_ROWS, rows - y)]
+                chunk[:, :columns] = grid[:, y:y + len(chunk)].T
+                quads = chunk.reshape(len(chunk), row_bytes, 4)
+                packed = quads[:, :, 0] | (quads[:, :, 1] << 2) | \
+                    (quads[:, :, 2] << 4) | (quads[:, :, 3] << 6)
+                f.write(packed.astype(np.uint8).tobytes())
+        else:
+            f.write(b'size %d %d\nstart %d %d\n' % (
+                columns - 1, rows - 1, start[0], start[1]))
+            chars = np.frombuffer(b'.WDC', dtype=np.uint8)
+            for y in range(rows):
+                f.write(chars[grid[:, y]].tobytes() + b'\n')
+
+
+def find_maps(directory):
+    """Return {name: MapFile subclass} for the map files of directory,
+    named after the files (without extension).  The class of a file is
+    kept until the file changes, so its template is built only once.
+    Map files need numpy: without it no map is found."""
+    maps = {}
+    if not HAVE_NUMPY or not os.path.isdir(directory):
+        return maps
+    for file_ in sorted(os.listdir(directory)):
+        name, ext = os.path.splitext(file_)
+        if ext in MAP_EXTENSIONS:
+            path = os.path.join(directory, file_)
+            key = (path, os.path.getmtime(path))
+            if key not in _CLASSES:
+                _CLASSES[key] = type(str(name), (MapFile,), dict(path=path))
+            maps[name] = _CLASSES[key]
+    return maps
@@ -0,0 +1,179 @@
+"""Procedural vacuum maps.
+
+Four kinds of layout are generated, each from a size and a seed, with
+whole-array numpy operations only (a 2000x2000 map takes a fraction of
+a second):
+
+    rooms      a room in every block of block x block cells, the rooms
+               joined by corridors along the middle of the blocks
+    maze       a perfect maze (binary tree algorithm) of one-cell paths
+    warehouse  an open floor with pillars, some of them left out
+    random     walls dropped at random with the given density
+
+Every free cell is dirty and the map is surrounded by walls.  The same
+kind, size, seed and parameters always give the same map: the numbers
+come from numpy's RandomState, whose stream never changes.
+
+    grid = generate('maze', 1999, 1999, seed=3)
+    env = map_class('rooms', 200, 200, seed=1).stamp()
+
+map_class() returns one GeneratedMap subclass per layout, so templates
+(VacuumEnvironment.template) are built once.  env_list.get_maps() lists
+the layouts of REGISTERED, and register() adds more.
+"""
+
+from agent_dir.agents import HAVE_NUMPY, VacuumEnvironment, WALL, DIRT
+
+__all__ = ["generate", "GeneratedMap", "map_class", "register",
+           "generated_maps", "GENERATORS", "REGISTERED"]
+
+
+def rooms(grid, random, block=12):
+    "Carve a room per block and corridors through the block middles."
+    import numpy as np
+    columns, rows = grid.shape
+    bx, lx = np.divmod(np.arange(columns), block)
+    by, ly = np.divmod(np.arange(rows), block)
+    shape = (bx[-1] + 1, by[-1] + 1)
+    half = block // 2
+    # Every room holds the middle of its block, where the corridors cross
+    x0 = random.randint(1, max(2, half - 1), shape)
+    x1 = random.randint(half + 1, block, shape)
+    y0 = random.randint(1, max(2, half - 1), shape)
+    y1 = random.randint(half + 1, block, shape)
+    lx, ly = lx[:, None], ly[None, :]
+    bx, by = bx[:, None], by[None, :]
+    room = (x0[bx, by] <= lx) & (lx < x1[bx, by]) & \
+        (y0[bx, by] <= ly) & (ly < y1[bx, by])
+    corridor = (lx == half) | (ly == half)
+    grid[room | corridor] = DIRT
+
+
+def maze(grid, random):
+    """Carve a binary tree maze: cells at odd coordinates, each joined
+    to the cell east or north of it."""
+    import numpy as np
+    columns, rows = grid.shape
+    xs = np.arange(1, columns - 1, 2)[:, None]
+    ys = np.arange(1, rows - 1, 2)[None, :]
+    grid[1:columns - 1:2, 1:rows - 1:2] = DIRT
+    can_east = np.broadcast_to(xs + 2 < columns - 1, (xs.size, ys.size))
+    can_north = np.broadcast_to(ys + 2 < rows - 1, (xs.size, ys.size))
+    east = can_east & ((random.random_sample(can_east.shape) < .5) |
+                       ~can_north)
+    north = can_north & ~east
+    cx, cy = np.nonzero(east)
+    grid[xs[cx, 0] + 1, ys[0, cy]] = DIRT
+    cx, cy = np.nonzero(north)
+    grid[xs[cx, 0], ys[0, cy] + 1] = DIRT
+
+
+def warehouse(grid, random, spacing=4, keep=0.85):
+    """An open floor with a 2x2 pillar every spacing cells; each pillar
+    is there with probability keep."""
+    import numpy as np
+    columns, rows = grid.shape
+    grid[...] = DIRT
+    lx = (np.arange(columns) % spacing)[:, None]
+    ly = (np.arange(rows) % spacing)[None, :]
+    pillar = (lx >= spacing - 2) & (ly >= spacing - 2)
+    px, py = np.arange(columns) // spacing, np.arange(rows) // spacing
+    kept = random.random_sample((px[-1] + 1, py[-1] + 1)) < keep
+    grid[pillar & kept[px[:, None], py[None, :]]] = WALL
+
+
+def random_walls(grid, random, density=0.2):
+    "Walls on a fraction density of the cells, dirt on the others."
+    import numpy as np
+    grid[...] = np.where(random.random_sample(grid.shape) < density,
+                         WALL, DIRT).astype(np.uint8)
+
+
+GENERATORS = {
+    'rooms': rooms,
+    'maze': maze,
+    'warehouse': warehouse,
+    'random': random_walls
+}
+
+
+def generate(kind, width, height, seed=0, **params):
+    """Return the uint8 tile grid, shaped (width + 1, height + 1), of a
+    layout.  params go to the generator (block for rooms, spacing and
+    keep for warehouse, density for random)."""
+    import numpy as np
+    grid = np.full((width + 1, height + 1), WALL, dtype=np.uint8)
+    GENERATORS[kind](grid, np.random.RandomState(seed), **params)
+    grid[0, :] = grid[-1, :] = WALL
+    grid[:, 0] = grid[:, -1] = WALL
+    return grid
+
+
+def first_free(grid):
+    "Return the first location of grid that is not a wall."
+    import numpy as np
+    index = int(np.argmax(grid != WALL))
+    return divmod(index, grid.shape[1])
+
+
+class GeneratedMap(VacuumEnvironment):
+
+    """A dense environment holding a generated layout.  The arguments
+    default to the class attributes, which map_class() sets.  The
+    agents start at the first free cell."""
+
+    dense = True
+    kind = 'rooms'
+    width = height = 40
+    seed = 0
+    params = {}
+
+    def __init__(self, kind=None, width=None, height=None, seed=None,
+                 **params):
+        kind = kind or self.kind
+        width = width or self.width
+        height = height or self.height
+        seed = self.seed if seed is None else seed
+        params = params or self.params
+        super(GeneratedMap, self).__init__(width, height, dense=True)
+        self.grid[...] = generate(kind, width, height, seed, **params)
+        self.start_from = first_free(self.grid)
+
+
+_CLASSES = {}
+
+
+def map_class(kind, width, height, seed=0, **params):
+    """Return the GeneratedMap subclass of a layout, named like
+    Maze63x63s0 and the same on every call."""
+    key = (kind, width, height, seed, tuple(sorted(params.items())))
+    if key not in _CLASSES:
+        name = '%s%dx%ds%d' % (kind.capitalize(), width, height, seed)
+        _CLASSES[key] = type(name, (GeneratedMap,), dict(
+            kind=kind, width=width, height=height, seed=seed,
+            params=params))
+    return _CLASSES[key]
+
+
+# (kind, width, height, seed, params) of the layouts in get_maps()
+REGISTERED = [
+    ('rooms', 60, 48, 0, {}),
+    ('maze', 39, 39, 0, {}),
+    ('warehouse', 80, 60, 0, {}),
+    ('random', 40, 40, 0, {'density': 0.2}),
+]
+
+
+def register(kind, width, height, seed=0, **params):
+    "Add a layout to the ones env_list.get_maps() lists."
+    REGISTERED.append((kind, width, height, seed, params))
+
+
+def generated_maps():
+    """Return {name: GeneratedMap subclass} for the registered layouts,
+    or nothing without numpy."""
+    if not HAVE_NUMPY:
+        return {}
+    classes = [map_class(kind, width, height, seed, **params)
+               for kind, width, height, seed, params in REGISTERED]
+    return dict((cls.__name__, cls) for cls in classes)
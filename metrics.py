@@ -0,0 +1,199 @@
+"""Live performance figures of a running environment.
+
+A StepMetrics is attached to an environment like a profiler, next to
+any other (see Environment.step and profiling.py), and measures from
+the timings of the step:
+
+    steps per second       over the last period seconds
+    decision latency       mean and 99th percentile of the last window
+                           program calls of every agent
+    render time per frame  reported by the UI with record_frame()
+    dirt remaining         counted when asked
+
+snapshot() may be called from any thread, such as the UI's while a
+SimThread steps the environment.  Both UIs show report() over the map;
+without a UI the same figures are printed or saved as JSON:
+
+    metrics = StepMetrics().attach(env)
+    env.run(1000)
+    print('\\n'.join(metrics.report()))
+
+    python metrics.py VacuumMap4 DeepBump GBAgent24R --steps 5000 --json m.json
+"""
+
+import argparse
+import collections
+import contextlib
+import io
+import json
+import math
+import threading
+import time
+
+import agent_list
+import env_list
+from agent_dir.agents import DIRT, Dirt
+from profiling import agent_label
+from utils import mean
+
+__all__ = ["StepMetrics"]
+
+
+class StepMetrics(object):
+
+    """Steps per second, agent decision latencies, frame render times and
+    dirt left of the environment it is attached to."""
+
+    def __init__(self, window=1000, period=.5, clock=time.perf_counter):
+        self.window = window
+        self.period = period
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.env = None
+        self.reset()
+
+    def reset(self):
+        "Forget everything measured so far."
+        with self.lock:
+            self.steps = 0
+            self.first_step = self.last_step = None
+            self.rate = 0.
+            self.period_start = self.clock()
+            self.period_steps = 0
+            self.latencies = {}
+            self.frames = collections.deque(maxlen=self.window)
+
+    def attach(self, env):
+        "Start measuring env (leaving the previous one); return the metrics."
+        self.detach()
+        env.profilers = env.profilers + (self,)
+        self.env = env
+        self.reset()
+        return self
+
+    def detach(self):
+        "Stop measuring the environment."
+        if self.env is not None:
+            self.env.profilers = tuple(profiler
+                                       for profiler in self.env.profilers
+                                       if profiler is not self)
+        self.env = None
+
+    def record_step(self, env, timings):
+        """Account the (phase, agent or None, start, end) timings of a
+        step.  Called by Environment.step when the metrics are attached."""
+        start, now = timings[-1][2:]
+        with self.lock:
+            self.steps += 1
+            if self.first_step is None:
+                self.first_step = start
+            self.last_step = now
+            self.period_steps += 1
+            if now - self.period_start >= self.period:
+                self.rate = self.period_steps / (now - self.period_start)
+                self.period_start = now
+                self.period_steps = 0
+            for phase, agent, called, returned in timings:
+                if phase != 'program':
+                    continue
+                latencies = self.latencies.get(agent)
+                if latencies is None:
+                    latencies = self.latencies[agent] = \
+                        collections.deque(maxlen=self.window)
+                latencies.append(returned - called)
+
+    def record_frame(self, seconds):
+        "Account the time the UI took to draw a frame."
+        with self.lock:
+            self.frames.append(seconds)
+
+    def dirt(self):
+        "Return the number of dirty cells, or None with no environment."
+        env = self.env
+        if env is None:
+            return None
+        if getattr(env, 'grid', None) is not None:
+            import numpy as np
+            return int(np.count_nonzero(env.grid == DIRT))
+        return len(env.buckets.get(Dirt, ()))
+
+    def snapshot(self):
+        """Return a dict of steps, steps_per_second (lately) and
+        mean_steps_per_second (from the first step to the last),
+        frame_ms (None before any frame), dirt and agents, which maps an
+        agent label to the samples, mean_us and p99_us of its last
+        program calls."""
+        now = self.clock()
+        with self.lock:
+            elapsed = now - self.period_start
+            rate = self.rate
+            # No period over yet, or a stalled run: count the current one
+            if (not rate or elapsed >= 2 * self.period) and elapsed > 0:
+                rate = self.period_steps / elapsed
+            overall = 0.
+            if self.steps and self.last_step > self.first_step:
+                overall = self.steps / (self.last_step - self.first_step)
+            # Agents that left the environment are not reported
+            agents = self.env.agents if self.env is not None else ()
+            latencies = [(agent, list(times))
+                         for agent, times in self.latencies.items()
+                         if agent in agents]
+            frames = list(self.frames)
+            steps = self.steps
+        agents = {}
+        for agent, times in latencies:
+            times.sort()
+            p99 = times[int(math.ceil(.99 * len(times))) - 1]
+            agents[agent_label(agent)] = dict(
+                samples=len(times), mean_us=mean(times) * 1e6,
+                p99_us=p99 * 1e6)
+        return dict(steps=steps, steps_per_second=rate,
+                    mean_steps_per_second=overall,
+                    frame_ms=mean(frames) * 1e3 if frames else None,
+                    dirt=self.dirt(), agents=agents)
+
+    def report(self):
+        "Return the snapshot as lines of text, the agents sorted by label."
+        stats = self.snapshot()
+        frame, dirt = stats['frame_ms'], stats['dirt']
+        lines = ['{0} steps  {1:.0f} steps/s (mean {2:.0f})  frame {3}  '
+                 'dirt {4}'.format(
+                     stats['steps'], stats['steps_per_second'],
+                     stats['mean_steps_per_second'],
+                     '-' if frame is None else '{0:.1f} ms'.format(frame),
+                     '-' if dirt is None else dirt)]
+        for label, agent in sorted(stats['agents'].items()):
+            lines.append('{0}: mean {1:.1f} us  p99 {2:.1f} us'.format(
+                label, agent['mean_us'], agent['p99_us']))
+        return lines
+
+    def dump(self, path):
+        "Save the snapshot as JSON."
+        with open(path, 'w') as f:
+            json.dump(self.snapshot(), f, indent=1, sort_keys=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Play agents on a map and print the step metrics.')
+    parser.add_argument('map')
+    parser.add_argument('agents', nargs='+')
+    parser.add_argument('--steps', type=int, default=1000)
+    parser.add_argument('--json', help='also save the metrics here')
+    args = parser.parse_args(argv)
+    all_agents = agent_list.load_agents()
+    env = env_list.get_maps()[args.map].stamp()
+    for slot, name in enumerate(args.agents, 1):
+        agent = all_agents[name]()
+        agent.id = 'agent_{0}'.format(slot)
+        env.add_thing(agent, env.start_from)
+    metrics = StepMetrics().attach(env)
+    with contextlib.redirect_stdout(io.StringIO()):
+        env.run(args.steps)
+    print('\n'.join(metrics.report()))
+    if args.json:
+        metrics.dump(args.json)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+"""Per-step profiling of an Environment.
+
+A StepProfiler attached to an environment records the timings
+Environment.step takes of every phase: the percept, the agent's program
+and execute_action for each agent, and the exogenous change.  Several
+profilers may be attached at once; environments without any (the
+default) take no timings.
+
+    profiler = StepProfiler(trace=True).attach(env)
+    env.run(1000)
+    profiler.print_summary()
+    profiler.save_chrome_trace('run.json')   # open in chrome://tracing
+"""
+
+import json
+import os
+
+from utils import print_table
+
+__all__ = ["StepProfiler", "agent_label"]
+
+
+def agent_label(agent):
+    "Return the name used for an agent in profiles: its id and class."
+    id_ = getattr(agent, 'id', None)
+    name = getattr(agent, 'name', agent.__class__.__name__)
+    if id_ is None:
+        return name
+    return '{0} ({1})'.format(id_, name)
+
+
+class StepProfiler(object):
+
+    """Wall-clock time and call counts per phase and per agent.
+    With trace=True every call is also kept as a Chrome trace event."""
+
+    def __init__(self, trace=False):
+        self.trace = trace
+        self.stats = {}
+        self.events = []
+        self.steps = 0
+        self.origin = None
+
+    def attach(self, env):
+        "Start profiling env's steps; return the profiler."
+        if self not in env.profilers:
+            env.profilers = env.profilers + (self,)
+        return self
+
+    def detach(self, env):
+        "Stop profiling env."
+        env.profilers = tuple(profiler for profiler in env.profilers
+                              if profiler is not self)
+
+    def record(self, phase, who, start, end):
+        "Account one call of phase by who (an agent label or 'env')."
+        stat = self.stats.get((phase, who))
+        if stat is None:
+            stat = self.stats[(phase, who)] = [0, 0.0, 0.0]
+        elapsed = end - start
+        stat[0] += 1
+        stat[1] += elapsed
+        stat[2] = max(stat[2], elapsed)
+        if self.trace:
+            self.events.append((phase, who, start, elapsed))
+
+    def record_step(self, env, timings):
+        """Account the (phase, agent or None, start, end) timings of a
+        step.  Called by Environment.step when the profiler is attached."""
+        if self.origin is None:
+            self.origin = timings[-1][2]
+        for phase, agent, start, end in timings:
+            self.record(phase, 'env' if agent is None else agent_label(agent),
+                        start, end)
+        self.steps += 1
+
+    def summary(self):
+        """Return [phase, who, calls, total ms, mean us, max us] rows,
+        the most expensive first."""
+        rows = [[phase, who, calls, total * 1e3, total / calls * 1e6,
+                 longest * 1e6]
+                for (phase, who), (calls, total, longest)
+                in self.stats.items()]
+        return sorted(rows, key=lambda row: -row[3])
+
+    def print_summary(self):
+        rows = [row[:3] + [round(value, 1) for value in row[3:]]
+                for row in self.summary()]
+        print_table(rows, header=['phase', 'who', 'calls', 'total ms',
+                                  'mean us', 'max us'], numfmt='%g')
+
+    def chrome_trace(self):
+        """Return the recorded calls in the Chrome trace-event format,
+        one thread per agent."""
+        pid = os.getpid()
+        threads = {}
+        events = []
+        for phase, who, start, elapsed in self.events:
+            tid = threads.setdefault(who, len(threads))
+            events.append({'name': phase, 'cat': 'env', 'ph': 'X',
+                           'ts': (start - self.origin) * 1e6,
+                           'dur': elapsed * 1e6,
+                           'pid': pid, 'tid': tid})
+        events.extend({'name': 'thread_name', 'ph': 'M', 'pid': pid,
+                       'tid': tid, 'args': {'name': who}}
+                      for who, tid in threads.items())
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    def save_chrome_trace(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.chrome_trace(), f)
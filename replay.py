@@ -0,0 +1,124 @@
+"""Replay recorded episodes without the agents.
+
+A Replay rebuilds the map named in a trace file (see tracefile.py),
+puts stand-in agents at the recorded start locations, and applies the
+recorded actions through VacuumEnvironment.execute_action; no agent
+program is ever called.  The world is kept in a dense grid and a
+snapshot is taken every keyframe_every steps on the first pass, so
+seek(n) only restores the nearest keyframe and replays the few steps
+after it.
+
+    replay = Replay(TraceReader('trace.bin'))
+    replay.seek(5000)
+    replay.env          # the world as it was after 5000 steps
+
+or from the command line:
+
+    python replay.py trace.bin 5000
+"""
+
+import copy
+import sys
+
+import env_list
+from agent_dir.agents import Agent, ACTION_NAMES
+from tracefile import TraceReader
+from utils import update
+
+__all__ = ["Replay", "ReplayAgent"]
+
+
+class ReplayAgent(Agent):
+
+    """Stands for a recorded agent; its program is never called."""
+
+    def __init__(self, label, id_=None, img=None):
+        Agent.__init__(self, lambda *percept: 'NoOp')
+        self.name = label
+        self.id = id_
+        self.img = img
+
+
+class Replay(object):
+
+    """Step through the episode of a TraceReader.  map_factory defaults
+    to the env_list map named in the trace."""
+
+    def __init__(self, reader, map_factory=None, keyframe_every=256):
+        header = reader.header
+        if map_factory is None:
+            map_factory = env_list.get_maps()[header['map']]
+        snapshot = copy.copy(map_factory.template())
+        update(snapshot, dense=True)
+        self.env = map_factory.from_snapshot(snapshot)
+        n_agents = len(header['agents'])
+        ids = header.get('ids') or [None] * n_agents
+        imgs = header.get('imgs') or [None] * n_agents
+        self.agents = []
+        for index, label in enumerate(header['agents']):
+            agent = ReplayAgent(label, ids[index], imgs[index])
+            self.env.add_thing(agent, tuple(header['start'][index]))
+            agent.performance = header['performance'][index]
+            self.agents.append(agent)
+
+        records = reader.array()
+        self.actions = records['action'].reshape(-1, n_agents).tolist()
+        self.keyframe_every = keyframe_every
+        self.keyframes = {0: self.env.snapshot()}
+        self.step = 0
+
+    def __len__(self):
+        "The number of recorded steps."
+        return len(self.actions)
+
+    def advance(self):
+        "Apply the actions of the current step."
+        execute_action = self.env.execute_action
+        for agent, code in zip(self.agents, self.actions[self.step]):
+            execute_action(agent, ACTION_NAMES[code])
+        self.step += 1
+        if self.step % self.keyframe_every == 0 and \
+                self.step not in self.keyframes:
+            self.keyframes[self.step] = self.env.snapshot()
+
+    def seek(self, step):
+        """Bring the world to the state after the given number of steps,
+        from the closest keyframe (or the current state) before it."""
+        step = max(0, min(step, len(self)))
+        if step < self.step or step - self.step > self.keyframe_every:
+            known = [key for key in self.keyframes if key <= step]
+            keyframe = max(known)
+            if keyframe > self.step or step < self.step:
+                self.env.restore(self.keyframes[keyframe])
+                self.step = keyframe
+        while self.step < step:
+            self.advance()
+        return self.env
+
+    def verify(self, reader):
+        """Replay the whole episode against its records and return the
+        first step where a location or performance delta differs, or
+        None if the replay matches."""
+        self.seek(0)
+        n_agents = len(self.agents)
+        records = reader.array()
+        scores = [agent.performance for agent in self.agents]
+        for step in range(len(self)):
+            self.advance()
+            for index, agent in enumerate(self.agents):
+                record = records[step * n_agents + index]
+                delta = agent.performance - scores[index]
+                scores[index] = agent.performance
+                if tuple(agent.location) != (record['x'], record['y']) or \
+                        delta != record['delta']:
+                    return step
+        return None
+
+
+if __name__ == '__main__':
+    replay = Replay(TraceReader(sys.argv[1]))
+    replay.seek(int(sys.argv[2]) if len(sys.argv) > 2 else len(replay))
+    print('step:%d' % replay.step)
+    for agent in replay.agents:
+        print('%s loc:%s perf:%s' % (agent.name, agent.location,
+                                     agent.performance))
@@ -0,0 +1,194 @@
+"""Run agents out of process.
+
+A SandboxedAgent stands in the environment for an agent whose program
+runs in a child process.  Percepts go to the child over a pipe and the
+actions come back the same way.  Environment.step first calls
+start_program() on every agent that has it, and only then asks for the
+actions, so all the sandboxed agents of a match think at the same time.
+
+A crash of the agent cannot take the match down: an exception in the
+program turns the step into a 'NoOp' (agent.errors counts them), and
+if the child dies the agent does 'NoOp' for the rest of the episode.
+The same call and episode budgets as BudgetAgent can be given; they
+are enforced by waiting on the pipe and killing the child, so they
+work on every platform.  A child killed on a timeout is replaced by a
+fresh one, which starts over with a new instance of the agent.
+
+Given a seed, the child seeds its random module with it before making
+the agent, so a sandboxed match is reproducible.  Its scores still
+differ from the same match played in process: there all the agents
+draw from the one random module of the environment, here each agent
+has its own.
+
+    env.add_thing(SandboxedAgent(DeepBumpClass, call_budget=0.1))
+    env.run(1000)
+    close_sandboxes(env.agents)
+"""
+
+import multiprocessing
+import os
+import random
+import sys
+import time
+
+from agent_dir.agents import Agent
+
+__all__ = ["SandboxedAgent", "sandboxed", "close_sandboxes"]
+
+
+def serve(conn, agent_class, quiet, seed=None):
+    """Child process main loop: seed random, build the agent, then answer
+    percepts with (action, error, cpu time) until a None message arrives."""
+    if quiet:
+        sys.stdout = open(os.devnull, 'w')
+    if seed is not None:
+        random.seed(seed)
+    agent = agent_class()
+    conn.send((getattr(agent, 'name', None), agent.img))
+    cpu_start = time.process_time()
+    while True:
+        try:
+            message = conn.recv()
+        except EOFError:
+            break
+        if message is None:
+            break
+        agent.id, percept = message
+        try:
+            action, error = agent.program(*percept), None
+        except Exception as e:
+            action, error = None, '{0}: {1}'.format(e.__class__.__name__, e)
+        conn.send((action, error, time.process_time() - cpu_start))
+
+
+class SandboxedAgent(Agent):
+
+    """An agent whose program is an instance of agent_class living in
+    a child process.  Takes the name and img of the real agent.  seed
+    (an int or str) seeds the random module of every child."""
+
+    def __init__(self, agent_class, call_budget=None, episode_budget=None,
+                 penalty=10, quiet=True, seed=None):
+        Agent.__init__(self, self.collect)
+        self.agent_class = agent_class
+        self.seed = seed
+        self.call_budget = call_budget
+        self.episode_budget = episode_budget
+        self.penalty = penalty
+        self.quiet = quiet
+        self.timeouts = 0
+        self.errors = 0
+        self.last_error = None
+        self.cpu_time = 0.0
+        self.cpu_spent = 0.0
+        self.conn = None
+        self.process = None
+        self.sent_at = None
+        self.spawn()
+
+    def spawn(self):
+        "Start a child process with a new instance of the agent."
+        conn, child_conn = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(
+            target=serve, args=(child_conn, self.agent_class, self.quiet,
+                                self.seed))
+        self.process.daemon = True
+        self.process.start()
+        child_conn.close()
+        self.conn = conn
+        name, img = conn.recv()
+        if name is not None:
+            self.name = name
+        self.img = img
+
+    def close(self):
+        "Stop the child process."
+        if self.conn is not None:
+            try:
+                self.conn.send(None)
+            except (OSError, EOFError):
+                pass
+            self.conn.close()
+            self.conn = None
+        if self.process is not None:
+            self.process.join(1)
+            if self.process.is_alive():
+                self.process.terminate()
+            self.process = None
+        self.sent_at = None
+
+    def kill(self):
+        "Stop a child that does not answer."
+        self.process.terminate()
+        self.process.join()
+        self.process = None
+        self.conn.close()
+        self.conn = None
+        self.sent_at = None
+
+    def budget_left(self):
+        "Return the seconds the pending call may still take, or None."
+        limit = self.call_budget
+        if self.episode_budget is not None:
+            remaining = self.episode_budget - self.cpu_time
+            limit = remaining if limit is None else min(limit, remaining)
+        if limit is None:
+            return None
+        return max(0.0, limit - (time.time() - self.sent_at))
+
+    def start_program(self, *percept):
+        "Send the percept to the child; collect() gets the action."
+        if self.conn is None or self.sent_at is not None:
+            return
+        if self.episode_budget is not None and \
+                self.cpu_time >= self.episode_budget:
+            return
+        self.conn.send((getattr(self, 'id', None), percept))
+        self.sent_at = time.time()
+
+    def collect(self, *percept):
+        """The agent's program: wait for the answer to the pending
+        percept (sending it first if start_program was not called)."""
+        self.start_program(*percept)
+        if self.sent_at is None:
+            return 'NoOp'
+        if not self.conn.poll(self.budget_left()):
+            # The stuck call is charged the time it was waited for
+            self.cpu_time += time.time() - self.sent_at
+            self.cpu_spent = self.cpu_time
+            self.kill()
+            self.timeouts += 1
+            self.performance -= self.penalty
+            if self.episode_budget is None or \
+                    self.cpu_time < self.episode_budget:
+                self.spawn()
+            return 'NoOp'
+        self.sent_at = None
+        try:
+            action, error, cpu_time = self.conn.recv()
+        except EOFError:
+            self.last_error = 'agent process died'
+            self.kill()
+            return 'NoOp'
+        self.cpu_time = self.cpu_spent + cpu_time
+        if error is not None:
+            self.errors += 1
+            self.last_error = error
+            return 'NoOp'
+        return action
+
+
+def sandboxed(agent_class, **options):
+    """Return a factory of SandboxedAgents for agent_class, usable where
+    an agent class is expected (e.g. in place of an agent_list entry)."""
+    def factory():
+        return SandboxedAgent(agent_class, **options)
+    factory.__name__ = agent_class.__name__
+    return factory
+
+
+def close_sandboxes(agents):
+    "Stop the child processes of the sandboxed agents among agents."
+    for agent in list(agents):
+        if isinstance(agent, SandboxedAgent):
+            agent.close()
@@ -0,0 +1,105 @@
+"""Run an environment in the background of a UI.
+
+A SimThread steps the environment in a thread of its own, so the
+simulation does not wait for the display.  What changed is collected by
+a TileView (see tileview.py) and published as a frame at most
+frame_rate times per second; frames the UI has not picked up yet are
+merged, so latest() always gives everything that changed since the last
+call.  The UI only draws frames and must not touch the environment
+until the thread is over.
+
+    sim = SimThread(env, steps=10000, turbo=True)
+    sim.start()
+    ...                      # once per frame, from the UI clock:
+    frame = sim.latest()     # None if nothing new
+
+With turbo off the environment does rate steps per second, the pace the
+UIs always had; with turbo on it steps as fast as it can.  turbo can be
+switched while the thread runs.
+"""
+
+import threading
+import time
+
+from tileview import TileView
+from utils import Struct
+
+__all__ = ["SimThread"]
+
+
+class SimThread(threading.Thread):
+
+    """Step env steps times (forever if None) in the background.  view
+    is the TileView to collect the changes with; by default a new one
+    is attached to env."""
+
+    def __init__(self, env, steps=None, rate=30., turbo=False,
+                 frame_rate=30., view=None):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.env = env
+        self.steps = steps
+        self.rate = rate
+        self.turbo = turbo
+        self.frame_rate = frame_rate
+        if view is None:
+            view = TileView().attach(env)
+        elif view.env is not env:
+            view.attach(env)
+        self.view = view
+        self.steps_done = 0
+        self.error = None
+        self.lock = threading.Lock()
+        self.pending = None
+        self.stopping = threading.Event()
+
+    def run(self):
+        clock = time.time
+        next_step = next_frame = clock()
+        try:
+            while not self.stopping.is_set() and \
+                    (self.steps is None or self.steps_done < self.steps):
+                if not self.turbo:
+                    delay = next_step - clock()
+                    if delay > 0 and self.stopping.wait(delay):
+                        break
+                    next_step = max(next_step, clock()) + 1. / self.rate
+                self.env.step()
+                self.steps_done += 1
+                if clock() >= next_frame:
+                    self.publish()
+                    next_frame = clock() + 1. / self.frame_rate
+        except Exception as e:
+            self.error = '{0}: {1}'.format(e.__class__.__name__, e)
+        finally:
+            self.publish()
+
+    def publish(self):
+        "Hand the changes since the last frame over to the UI."
+        full, tiles, agents = self.view.flush()
+        scores = dict((agent, agent.performance)
+                      for agent in self.env.agents)
+        with self.lock:
+            frame = self.pending
+            if frame is None or full:
+                self.pending = Struct(full=full, tiles=tiles, agents=agents,
+                                      scores=scores, step=self.steps_done)
+            else:
+                frame.tiles.update(tiles)
+                frame.agents.update(agents)
+                frame.scores = scores
+                frame.step = self.steps_done
+
+    def latest(self):
+        """Return the frame published since the last call, or None.
+        A frame has full, tiles and agents as TileView.flush() returns
+        them, the agents' scores and the number of steps done."""
+        with self.lock:
+            frame, self.pending = self.pending, None
+        return frame
+
+    def stop(self):
+        "Stop after the current step and wait for the thread."
+        self.stopping.set()
+        if self.is_alive():
+            self.join()
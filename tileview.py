@@ -0,0 +1,108 @@
+"""What a vacuum map looks like, and what changed since the last frame.
+
+A TileView is an environment observer (see XYEnvironment.add_observer).
+It keeps the tile drawn at every location (Wall, Dirt or Clean) and the
+location of every agent, and collects the locations and agents that
+changed until the renderer asks for them with flush().  The renderer
+can then update only those parts of the canvas, so the cost of a frame
+depends on the number of changes and not on the size of the map.
+
+    view = TileView().attach(env)
+    env.step()
+    full, tiles, agents = view.flush()
+
+Environments do not tell their observers about restore() or clear();
+call rebuild() after them.
+"""
+
+from agent_dir.agents import Agent, TILES
+
+__all__ = ["TileView"]
+
+
+class TileView(object):
+
+    """Tile class per location and location per agent of an environment,
+    with the changes since the last flush()."""
+
+    def __init__(self):
+        self.env = None
+        self.tiles = {}
+        self.agents = {}
+        self.changed_tiles = set()
+        self.changed_agents = set()
+        self.full = True
+
+    def attach(self, env):
+        "Start observing env (leaving the previous one); return the view."
+        if self.env is not None:
+            self.detach()
+        self.env = env
+        env.add_observer(self)
+        self.rebuild()
+        return self
+
+    def detach(self):
+        "Stop observing the environment."
+        if self.env is not None and self in self.env.observers:
+            self.env.observers.remove(self)
+        self.env = None
+        self.rebuild()
+
+    def rebuild(self):
+        "Read the whole environment again; the next flush is a full one."
+        self.tiles = {}
+        self.agents = {}
+        if self.env is not None:
+            for thing in self.env.things:
+                if thing.__class__ in TILES:
+                    self.tiles[thing.location] = thing.__class__
+                elif isinstance(thing, Agent):
+                    self.agents[thing] = thing.location
+        self.changed_tiles = set()
+        self.changed_agents = set()
+        self.full = True
+
+    def flush(self):
+        """Return (full, tiles, agents) and forget the changes.  tiles
+        maps the locations whose tile changed to their tile class (None
+        for no tile) and agents maps the agents that moved, arrived or
+        left to their location (None once gone).  When full is true they
+        hold the whole environment instead."""
+        if self.full:
+            tiles, agents = dict(self.tiles), dict(self.agents)
+        else:
+            tiles = dict((location, self.tiles.get(location))
+                         for location in self.changed_tiles)
+            agents = dict((agent, self.agents.get(agent))
+                          for agent in self.changed_agents)
+        changes = (self.full, tiles, agents)
+        self.changed_tiles = set()
+        self.changed_agents = set()
+        self.full = False
+        return changes
+
+    # Observer hooks
+
+    def thing_added(self, thing):
+        if thing.__class__ in TILES:
+            self.tiles[thing.location] = thing.__class__
+            self.changed_tiles.add(thing.location)
+        elif isinstance(thing, Agent):
+            self.agents[thing] = thing.location
+            self.changed_agents.add(thing)
+
+    def thing_moved(self, thing):
+        if thing in self.agents:
+            self.agents[thing] = thing.location
+            self.changed_agents.add(thing)
+
+    def thing_deleted(self, thing):
+        if thing.__class__ in TILES:
+            # Dirt is replaced by Clean before its deletion is reported
+            if self.tiles.get(thing.location) is thing.__class__:
+                del self.tiles[thing.location]
+                self.changed_tiles.add(thing.location)
+        elif thing in self.agents:
+            del self.agents[thing]
+            self.changed_agents.add(thing)
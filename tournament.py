@@ -0,0 +1,216 @@
+"""Headless tournament runner.
+
+Runs every combination of (agent set, map, seed, step budget) without
+the Kivy UIs, spread over a process pool, and writes one CSV row per
+agent and match.  Agents come from agent_list.load_agents() and maps
+from env_list.get_maps().
+
+From the command line:
+
+    python tournament.py --players 2 --seeds 20 --steps 500 1000 \\
+        --out scores.csv
+
+or from Python:
+
+    rows = tournament([('DeepBump', 'GBAgent24R')], ['VacuumMap4'],
+                      seeds=range(20), steps=[1000])
+"""
+
+import argparse
+import contextlib
+import csv
+import itertools
+import os
+import random
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+import agent_list
+import env_list
+from agent_dir.agents import BudgetAgent
+from sandbox import SandboxedAgent, close_sandboxes
+from utils import mean, print_table
+
+__all__ = ["match_tasks", "run_match", "tournament", "write_scores",
+           "summary"]
+
+FIELDS = ["agents", "map", "seed", "steps", "slot", "agent", "score",
+          "timeouts", "error"]
+
+_AGENTS = None
+_MAPS = None
+
+
+def _load():
+    "Load agents and maps once per process."
+    global _AGENTS, _MAPS
+    if _AGENTS is None:
+        _AGENTS = agent_list.load_agents()
+        _MAPS = env_list.get_maps()
+    return _AGENTS, _MAPS
+
+
+def new_env(map_name):
+    """Return a fresh environment for the map, stamped from the template
+    built the first time the map is used in this process."""
+    all_agents, all_maps = _load()
+    return all_maps[map_name].stamp()
+
+
+def match_tasks(agent_sets, maps, seeds, steps):
+    """Return the cross product of the arguments as match tasks:
+    (agent names, map name, seed, step budget) tuples."""
+    return [(tuple(agents), map_name, seed, n_steps)
+            for agents, map_name, seed, n_steps
+            in itertools.product(agent_sets, maps, seeds, steps)]
+
+
+def run_match(task, random_start=False, budgets=None, sandbox=False):
+    """Play one match and return its rows, one per agent slot.
+    The agents' output is discarded; an exception raised by an agent
+    ends the match and is recorded in the error column.  budgets, if
+    given, are keyword arguments for BudgetAgent (call_budget,
+    episode_budget, penalty) applied to every agent.  With sandbox
+    every agent runs in a child process of its own (see sandbox.py),
+    seeded from the match seed and its slot: sandboxed scores are
+    reproducible, but not the same as the in-process ones."""
+    agents, map_name, seed, n_steps = task
+    all_agents, all_maps = _load()
+    env = new_env(map_name)
+    random.seed(seed)
+    players = []
+    for slot, name in enumerate(agents, 1):
+        if sandbox:
+            agent = SandboxedAgent(all_agents[name],
+                                   seed='{0}/{1}'.format(seed, slot),
+                                   **(budgets or {}))
+        else:
+            agent = all_agents[name]()
+            if budgets:
+                BudgetAgent(agent, **budgets)
+        agent.id = 'agent_{0}'.format(slot)
+        if random_start:
+            env.add_thing(agent, location=env.random_location())
+        else:
+            env.add_thing(agent, location=env.start_from)
+        players.append(agent)
+    error = ''
+    with open(os.devnull, 'w') as devnull:
+        with contextlib.redirect_stdout(devnull):
+            try:
+                env.run(n_steps)
+            except Exception as e:
+                error = '{0}: {1}'.format(e.__class__.__name__, e)
+            finally:
+                close_sandboxes(players)
+    return [dict(agents='+'.join(agents), map=map_name, seed=seed,
+                 steps=n_steps, slot=slot, agent=name,
+                 score=agent.performance,
+                 timeouts=getattr(agent, 'timeouts', 0),
+                 error=error or getattr(agent, 'last_error', None) or '')
+            for slot, (name, agent) in enumerate(zip(agents, players), 1)]
+
+
+def tournament(agent_sets, maps, seeds, steps, workers=None,
+               chunksize=None, random_start=False, budgets=None,
+               sandbox=False):
+    """Run all the matches of the cross product and return their rows.
+    workers=0 runs in this process; otherwise a ProcessPoolExecutor
+    with that many workers (default: one per CPU) is fed the tasks in
+    chunks of chunksize (default: about four chunks per worker).
+    Every worker runs its matches in its main thread, so the budgets
+    can interrupt a stuck agent."""
+    tasks = match_tasks(agent_sets, maps, seeds, steps)
+    play = partial(run_match, random_start=random_start, budgets=budgets,
+                   sandbox=sandbox)
+    if workers == 0:
+        results = map(play, tasks)
+        return [row for rows in results for row in rows]
+    workers = workers or os.cpu_count() or 1
+    if chunksize is None:
+        chunksize = max(1, len(tasks) // (workers * 4))
+    with ProcessPoolExecutor(max_workers=workers, initializer=_load) as pool:
+        results = pool.map(play, tasks, chunksize=chunksize)
+        return [row for rows in results for row in rows]
+
+
+def write_scores(rows, out):
+    "Write the rows as CSV to a file name or an open file."
+    if isinstance(out, str):
+        with open(out, 'w') as f:
+            return write_scores(rows, f)
+    writer = csv.DictWriter(out, fieldnames=FIELDS)
+    writer.writeheader()
+    writer.writerows(rows)
+
+
+def summary(rows):
+    """Return a table of [agent, map, matches, errors, mean score] rows,
+    one per agent and map."""
+    groups = {}
+    for row in rows:
+        groups.setdefault((row['agent'], row['map']), []).append(row)
+    return [[agent, map_name, len(group),
+             sum(1 for row in group if row['error']),
+             mean([row['score'] for row in group])]
+            for (agent, map_name), group in sorted(groups.items())]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--agents', nargs='+',
+                        help="agents to play (default: all)")
+    parser.add_argument('--maps', nargs='+',
+                        help="maps to play on (default: all)")
+    parser.add_argument('--players', type=int, default=1,
+                        help="agents per match; every combination "
+                             "of the agents is played (default: 1)")
+    parser.add_argument('--seeds', type=int, default=10,
+                        help="number of seeds per match (default: 10)")
+    parser.add_argument('--steps', type=int, nargs='+', default=[1000],
+                        help="step budgets (default: 1000)")
+    parser.add_argument('--workers', type=int, default=None,
+                        help="worker processes, 0 to run in-process "
+                             "(default: one per CPU)")
+    parser.add_argument('--chunksize', type=int, default=None)
+    parser.add_argument('--random-start', action='store_true',
+                        help="place the agents at random locations")
+    parser.add_argument('--call-budget', type=float, default=None,
+                        help="seconds an agent may think per step")
+    parser.add_argument('--episode-budget', type=float, default=None,
+                        help="CPU seconds an agent may use per match")
+    parser.add_argument('--timeout-penalty', type=int, default=10,
+                        help="points lost per timeout (default: 10)")
+    parser.add_argument('--sandbox', action='store_true',
+                        help="run every agent in a process of its own "
+                        "(scores differ from in-process runs)")
+    parser.add_argument('--out', default='scores.csv',
+                        help="CSV file for the scores, - for stdout")
+    args = parser.parse_args(argv)
+
+    all_agents, all_maps = _load()
+    agents = sorted(args.agents or all_agents)
+    maps = sorted(args.maps or all_maps)
+    agent_sets = list(itertools.combinations(agents, args.players))
+
+    budgets = None
+    if args.call_budget is not None or args.episode_budget is not None:
+        budgets = dict(call_budget=args.call_budget,
+                       episode_budget=args.episode_budget,
+                       penalty=args.timeout_penalty)
+    rows = tournament(agent_sets, maps, range(args.seeds), args.steps,
+                      workers=args.workers, chunksize=args.chunksize,
+                      random_start=args.random_start, budgets=budgets,
+                      sandbox=args.sandbox)
+    if args.out == '-':
+        write_scores(rows, sys.stdout)
+    else:
+        write_scores(rows, args.out)
+        print_table(summary(rows),
+                    header=['agent', 'map', 'matches', 'errors', 'mean'],
+                    numfmt='%g')
+
+
+if __name__ == '__main__':
+    main()
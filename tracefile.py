@@ -0,0 +1,148 @@
+"""Compact binary traces of vacuum episodes.
+
+A TraceRecorder attached to a VacuumEnvironment writes one fixed-width
+record per agent and step to a buffered file, instead of the line of
+text TraceAgent prints.  A trace file is:
+
+    b'VTRC', a uint32 header length, a JSON header (map, size, agent
+    labels, ids, images, start locations and scores), then
+    RECORD-sized records.
+
+Each record holds the step, the agent index, the percept bits (1 for
+dirty, 2 for bump), the agent location after its action, the action
+code (agents.ACTION_CODES) and the change of the agent's performance.
+TraceReader streams the records, or maps them into a numpy array, and
+text_view() turns them back into readable lines:
+
+    python tracefile.py trace.bin
+"""
+
+import json
+import struct
+import sys
+
+from agent_dir.agents import ACTION_CODES, ACTION_NAMES, OTHER
+from profiling import agent_label
+
+__all__ = ["TraceRecorder", "TraceReader", "text_view", "RECORD"]
+
+MAGIC = b'VTRC'
+RECORD = struct.Struct('<IBBhhBxi')
+DIRTY, BUMP = 1, 2
+
+RECORD_DTYPE = [('step', '<u4'), ('agent', 'u1'), ('percept', 'u1'),
+                ('x', '<i2'), ('y', '<i2'), ('action', 'u1'),
+                ('pad', 'u1'), ('delta', '<i4')]
+
+
+class TraceRecorder(object):
+
+    """Record the episode of env to path.  The agents must be in the
+    environment when the recorder is attached; their locations then are
+    saved as the start locations.  With max_steps only the first
+    max_steps steps are recorded."""
+
+    def __init__(self, path, map_name=None, buffering=1 << 16,
+                 max_steps=None):
+        self.path = path
+        self.map_name = map_name
+        self.max_steps = max_steps
+        self.file = open(path, 'wb', buffering)
+        self.step = 0
+        self.scores = []
+
+    def attach(self, env):
+        "Write the header and start recording env's steps."
+        header = dict(
+            map=self.map_name, width=env.width, height=env.height,
+            agents=[agent_label(agent) for agent in env.agents],
+            ids=[getattr(agent, 'id', None) for agent in env.agents],
+            imgs=[agent.img for agent in env.agents],
+            start=[list(agent.location) for agent in env.agents],
+            performance=[agent.performance for agent in env.agents])
+        data = json.dumps(header).encode('utf-8')
+        self.file.write(MAGIC + struct.pack('<I', len(data)) + data)
+        self.scores = [agent.performance for agent in env.agents]
+        env.recorder = self
+        return self
+
+    def detach(self, env):
+        env.recorder = None
+        self.close()
+
+    def record(self, env, percepts, actions):
+        "Write the records of one step.  Called by Environment.step."
+        if self.max_steps is not None and self.step >= self.max_steps:
+            return
+        write, pack = self.file.write, RECORD.pack
+        for index, (agent, percept, action) in enumerate(
+                zip(env.agents, percepts, actions)):
+            status, bump = percept[0], percept[1]
+            bits = (DIRTY if status == 'Dirty' else 0) | \
+                (BUMP if bump == 'Bump' else 0)
+            x, y = agent.location
+            delta = agent.performance - self.scores[index]
+            self.scores[index] = agent.performance
+            write(pack(self.step, index, bits, x, y,
+                       ACTION_CODES.get(action, OTHER), delta))
+        self.step += 1
+
+    def close(self):
+        if not self.file.closed:
+            self.file.close()
+
+
+class TraceReader(object):
+
+    """Read a trace file written by TraceRecorder."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            if f.read(4) != MAGIC:
+                raise ValueError("%s is not a trace file" % path)
+            length, = struct.unpack('<I', f.read(4))
+            self.header = json.loads(f.read(length).decode('utf-8'))
+        self.offset = 8 + length
+
+    def records(self, chunk=4096):
+        "Yield the records as tuples, reading the file in chunks."
+        size = RECORD.size * chunk
+        with open(self.path, 'rb') as f:
+            f.seek(self.offset)
+            while True:
+                data = f.read(size)
+                if not data:
+                    return
+                data = data[:len(data) - len(data) % RECORD.size]
+                for record in RECORD.iter_unpack(data):
+                    yield record
+
+    def array(self):
+        """Return the records as a numpy structured array mapped onto
+        the file (see RECORD_DTYPE)."""
+        import numpy as np
+        with open(self.path, 'rb') as f:
+            f.seek(0, 2)
+            n_records = (f.tell() - self.offset) // RECORD.size
+        if n_records == 0:
+            return np.zeros(0, dtype=RECORD_DTYPE)
+        return np.memmap(self.path, dtype=RECORD_DTYPE, mode='r',
+                         offset=self.offset, shape=(n_records,))
+
+
+def text_view(reader):
+    "Yield one line of text per record, much like TraceAgent prints."
+    labels = reader.header['agents']
+    scores = list(reader.header['performance'])
+    for step, index, bits, x, y, action, delta in reader.records():
+        scores[index] += delta
+        yield 'step:%d %s loc:(%d, %d) perf:%d percept:(%s, %s) action:%s' % (
+            step, labels[index], x, y, scores[index],
+            'Dirty' if bits & DIRTY else 'Clean',
+            'Bump' if bits & BUMP else 'None', ACTION_NAMES[action])
+
+
+if __name__ == '__main__':
+    for line in text_view(TraceReader(sys.argv[1])):
+        print(line)
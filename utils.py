@@ -10,7 +10,11 @@ import copy
 import sys
 import os.path
 import bisect
+import heapq
+import itertools
 import re
+import time
+import weakref
 import collections
 from functools import reduce
 
@@ -64,6 +68,56 @@ class Struct:
         return 'Struct(%s)' % ', '.join(sorted(args))
 
 
+class OrderedSet(object):
+
+    """A set that remembers insertion order and also speaks the list
+    methods append and remove.  Membership, append and remove are O(1),
+    and iteration follows insertion order, so it is a drop-in for a list
+    of distinct hashable items that is mostly appended to and removed from.
+    >>> s = OrderedSet([3, 1, 2])
+    >>> s.remove(1)
+    >>> s.append(5)
+    >>> list(s), 2 in s, len(s)
+    ([3, 2, 5], True, 3)
+    """
+
+    def __init__(self, items=()):
+        self.items = collections.OrderedDict()
+        self.extend(items)
+
+    def append(self, item):
+        self.items[item] = None
+
+    def extend(self, items):
+        for item in items:
+            self.items[item] = None
+
+    def remove(self, item):
+        try:
+            del self.items[item]
+        except KeyError:
+            raise ValueError('OrderedSet.remove(x): x not in set')
+
+    def discard(self, item):
+        self.items.pop(item, None)
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+    def __contains__(self, item):
+        return item in self.items
+
+    def __getitem__(self, index):
+        "Positional access; O(n), kept for code that indexes a list."
+        return list(self.items)[index]
+
+    def __repr__(self):
+        return 'OrderedSet(%r)' % list(self.items)
+
+
 def update(x, **entries):
     """Update a dict; or an object with slots; according to entries.
     >>> update({'a': 1}, a=10, b=20)
@@ -453,10 +507,14 @@ def caller(n=1):
     return inspect.getouterframes(inspect.currentframe())[n][3]
 
 
-def memoize(fn, slot=None):
+def memoize(fn, slot=None, maxsize=None, ttl=None):
     """Memoize fn: make it remember the computed value for any argument list.
     If slot is specified, store result in that slot of first argument.
-    If slot is false, store results in a dictionary."""
+    If slot is false, store results in a dictionary.
+    With a maxsize or a ttl the results are kept in an LRUCache instead
+    (see lru_memoize); a slot then holds one cache per first argument."""
+    if maxsize is not None or ttl is not None:
+        return lru_memoize(maxsize, ttl, slot)(fn)
     if slot:
         def memoized_fn(obj, *args):
             if hasattr(obj, slot):
@@ -474,6 +532,133 @@ def memoize(fn, slot=None):
     return memoized_fn
 
 
+class LRUCache(object):
+
+    """A cache of at most maxsize values (None for no limit), each kept
+    for ttl seconds at most (None for ever).  When full, the least
+    recently used value is evicted, and the expired ones are dropped
+    whenever a value is added.  Hits, misses and evictions are counted
+    in stats, which several caches may share.
+    >>> c = LRUCache(2)
+    >>> [c.get(x, lambda: x * x) for x in (1, 2, 1, 3, 2)]
+    [1, 4, 1, 9, 4]
+    >>> c.stats
+    Struct(evictions=2, hits=1, misses=4)
+    >>> c = LRUCache(10, ttl=3600)
+    >>> for x in range(1000):
+    ...     _ = c.get(x, lambda: x)
+    >>> len(c), len(c.expiries) <= 2 * len(c) + 32
+    (10, True)
+    """
+
+    def __init__(self, maxsize=128, ttl=None, stats=None, clock=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock or time.time
+        self.stats = stats or Struct(hits=0, misses=0, evictions=0)
+        self.data = collections.OrderedDict()
+        self.expiries = collections.deque()  # (expires, key), oldest first
+
+    def get(self, key, compute):
+        """Return the value of key, calling compute() to get it if it is
+        not cached or has expired."""
+        entry = self.data.pop(key, None)
+        now = self.clock() if self.ttl is not None else None
+        if entry is not None and (now is None or entry[0] > now):
+            self.stats.hits += 1
+            self.data[key] = entry
+            return entry[1]
+        self.stats.misses += 1
+        value = compute()
+        if now is not None:
+            self.purge(now)
+            self.data[key] = (now + self.ttl, value)
+            self.expiries.append((now + self.ttl, key))
+        else:
+            self.data[key] = (False, value)
+        if self.maxsize is not None:
+            while len(self.data) > self.maxsize:
+                self.data.popitem(last=False)
+                self.stats.evictions += 1
+        if len(self.expiries) > 2 * len(self.data) + 32:
+            self.compact()
+        return value
+
+    def purge(self, now):
+        "Drop the values expired at time now."
+        expiries, data = self.expiries, self.data
+        while expiries and expiries[0][0] <= now:
+            expires, key = expiries.popleft()
+            entry = data.get(key)
+            # The key may have been evicted, or added again since
+            if entry is not None and entry[0] == expires:
+                del data[key]
+
+    def compact(self):
+        "Forget the expiry times of the evicted and replaced values."
+        data = self.data
+        self.expiries = collections.deque(
+            (expires, key) for expires, key in self.expiries
+            if key in data and data[key][0] == expires)
+
+    def __len__(self):
+        return len(self.data)
+
+    def clear(self):
+        self.data.clear()
+        self.expiries.clear()
+
+
+def lru_memoize(maxsize=128, ttl=None, slot=None):
+    """Decorator: memoize a function in an LRUCache of maxsize values kept
+    ttl seconds at most.  With a slot, every first argument gets a cache
+    of its own in that attribute, keyed by the other arguments, and the
+    cache goes away with the object.  The function gets cache_info(),
+    which returns the hits, misses, evictions and size of all its caches,
+    and cache_clear(), which empties them and resets the counts.
+    >>> @lru_memoize(maxsize=1)
+    ... def square(x):
+    ...     return x * x
+    >>> square(2), square(2), square(3), square(2)
+    (4, 4, 9, 4)
+    >>> square.cache_info()
+    Struct(currsize=1, evictions=2, hits=1, maxsize=1, misses=3)
+    """
+    def decorator(fn):
+        stats = Struct(hits=0, misses=0, evictions=0)
+        caches = weakref.WeakSet()
+        if slot:
+            def memoized_fn(obj, *args):
+                cache = getattr(obj, slot, None)
+                if cache is None:
+                    cache = LRUCache(maxsize, ttl, stats)
+                    setattr(obj, slot, cache)
+                    caches.add(cache)
+                return cache.get(args, lambda: fn(obj, *args))
+        else:
+            shared = LRUCache(maxsize, ttl, stats)
+            caches.add(shared)
+
+            def memoized_fn(*args):
+                return shared.get(args, lambda: fn(*args))
+
+        def cache_info():
+            return Struct(hits=stats.hits, misses=stats.misses,
+                          evictions=stats.evictions, maxsize=maxsize,
+                          currsize=sum(len(cache) for cache in caches))
+
+        def cache_clear():
+            for cache in list(caches):
+                cache.clear()
+            stats.hits = stats.misses = stats.evictions = 0
+        memoized_fn.cache_info = cache_info
+        memoized_fn.cache_clear = cache_clear
+        memoized_fn.__name__ = fn.__name__
+        memoized_fn.__doc__ = fn.__doc__
+        return memoized_fn
+    return decorator
+
+
 def if_(test, result, alternative):
     """Like C++ and Java's (test ? result : alternative), except
     both result and alternative are always evaluated. However, if
@@ -577,31 +762,44 @@ def Stack():
 
 class FIFOQueue(Queue):
 
-    """A First-In-First-Out Queue."""
+    """A First-In-First-Out Queue.  The items are kept in a deque, and
+    item in q scans it.  With index=True a count of each item is kept
+    as well, so that item in q is O(1); items must then be hashable.
+    Only ask for it when membership is tested, as for a search frontier:
+    it makes append and pop slower."""
 
-    def __init__(self):
-        self.A = []
-        self.start = 0
+    def __init__(self, index=False):
+        self.A = collections.deque()
+        self.counts = collections.Counter() if index else None
 
     def append(self, item):
         self.A.append(item)
+        if self.counts is not None:
+            self.counts[item] += 1
 
     def __len__(self):
-        return len(self.A) - self.start
+        return len(self.A)
 
     def extend(self, items):
-        self.A.extend(items)
+        if self.counts is None:
+            self.A.extend(items)
+        else:
+            for item in items:
+                self.append(item)
 
     def pop(self):
-        e = self.A[self.start]
-        self.start += 1
-        if self.start > 5 and self.start > len(self.A) / 2:
-            self.A = self.A[self.start:]
-            self.start = 0
+        e = self.A.popleft()
+        if self.counts is not None:
+            if self.counts[e] == 1:
+                del self.counts[e]
+            else:
+                self.counts[e] -= 1
         return e
 
     def __contains__(self, item):
-        return item in self.A[self.start:]
+        if self.counts is None:
+            return item in self.A
+        return item in self.counts
 
 
 class PriorityQueue(Queue):
@@ -609,36 +807,72 @@ class PriorityQueue(Queue):
     """A queue in which the minimum (or maximum) element (as determined by f and
     order) is returned first. If order is min, the item with minimum f(x) is
     returned first; if order is max, then it is the item with maximum f(x).
-    Also supports dict-like lookup."""
+    Also supports dict-like lookup.
+
+    The items are kept in a binary heap with an index from item to heap
+    entry, so items must be hashable and an item is in the queue at most
+    once: appending it again moves it to its new f value (decrease-key).
+    append, pop and del q[item] are O(log n); item in q is O(1).  Items
+    of equal f come out in the order they went in for min, in reverse
+    order for max."""
 
     def __init__(self, order=min, f=lambda x: x):
-        update(self, A=[], order=order, f=f)
+        update(self, A=[], order=order, f=f, entries={},
+               counter=itertools.count())
 
     def append(self, item):
-        bisect.insort(self.A, (self.f(item), item))
+        if item in self.entries:
+            del self[item]
+        if self.order == min:
+            entry = [(self.f(item), next(self.counter)), item]
+        else:
+            entry = [_Reversed((self.f(item), next(self.counter))), item]
+        self.entries[item] = entry
+        heapq.heappush(self.A, entry)
 
     def __len__(self):
-        return len(self.A)
+        return len(self.entries)
 
     def pop(self):
-        if self.order == min:
-            return self.A.pop(0)[1]
-        else:
-            return self.A.pop()[1]
+        while self.A:
+            key, item = heapq.heappop(self.A)
+            if item is not _REMOVED:
+                del self.entries[item]
+                return item
+        raise IndexError('pop from an empty priority queue')
 
     def __contains__(self, item):
-        return some(lambda __x: __x[1] == item, self.A)
+        return item in self.entries
 
     def __getitem__(self, key):
-        for _, item in self.A:
-            if item == key:
-                return item
+        entry = self.entries.get(key)
+        if entry is not None:
+            return entry[1]
 
     def __delitem__(self, key):
-        for i, (value, item) in enumerate(self.A):
-            if item == key:
-                self.A.pop(i)
-                return
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            # Left in the heap until it comes up, unless half of it is dead
+            entry[1] = _REMOVED
+            if len(self.A) > 2 * len(self.entries) + 32:
+                self.A = [e for e in self.A if e[1] is not _REMOVED]
+                heapq.heapify(self.A)
+
+
+_REMOVED = object()
+
+
+class _Reversed(object):
+
+    "A key ordered the other way round, to keep the largest on a min-heap."
+
+    __slots__ = ('key',)
+
+    def __init__(self, key):
+        self.key = key
+
+    def __lt__(self, other):
+        return other.key < self.key
 
 # Fig: The idea is we can define things like Fig[3,10] later.
 # Alas, it is Fig[3,10] not Fig[3.10], because that would be the same
@@ -796,6 +1030,22 @@ calculating gnp ...
 >>> q.pop(), q.pop()
 (1, 2)
 
+>>> q = FIFOQueue(index=True)
+>>> q.extend([1, 2, 1])
+>>> q.pop(), 1 in q, 3 in q
+(1, True, False)
+
+>>> cost = {'a': 3, 'b': 1, 'c': 2}
+>>> q = PriorityQueue(min, lambda x: cost[x])
+>>> q.extend('abc')
+>>> cost['a'] = 0
+>>> q.append('a')
+>>> del q['c']
+>>> len(q), 'c' in q, q['a']
+(2, False, 'a')
+>>> q.pop(), q.pop()
+('a', 'b')
+
 
 >>> abc = set('abc')
 >>> bcd = set('bcd')
@@ -0,0 +1,174 @@
+"""Step many copies of a vacuum world at once.
+
+VectorVacuumEnv holds K independent worlds built from the same map as
+stacked numpy arrays: a K x W x H grid of tile codes, K x A agent
+positions, bump flags and scores.  Agent programs are still called one
+by one, but percepts are computed and actions applied for all the
+worlds in a single pass per agent slot, without any Thing objects.
+
+The rules are those of VacuumEnvironment: Suck scores 100 on dirt and
+-20 elsewhere, any other action but NoOp costs 5, and a move into a
+wall sets the bump flag.  Unlike XYEnvironment, a move off the grid is
+treated as a bump too.
+
+>>> import env_list
+>>> from agent_dir.agents import Agent
+>>> def factory():
+...     return Agent(lambda status, bump, neighbors: 'Suck')
+>>> venv = VectorVacuumEnv(env_list.VacuumMap3, [factory, factory], [1, 2])
+>>> venv.run(2)
+>>> venv.scores.tolist()
+[[80, -40], [80, -40]]
+"""
+
+import random
+
+import numpy as np
+
+from agent_dir.agents import WALL, DIRT, CLEAN, SUCK, GO_NORTH, OTHER, \
+    ACTION_CODES
+
+__all__ = ["VectorVacuumEnv"]
+
+STATUS = {True: 'Dirty', False: 'Clean'}
+BUMP = {True: 'Bump', False: 'None'}
+
+MOVES = np.array([(0, 0), (0, 0), (0, 1), (0, -1), (1, 0), (-1, 0), (0, 0)])
+
+
+class VectorVacuumEnv(object):
+
+    """K vacuum worlds, one per seed, each started from a fresh instance
+    of map_factory and populated with one agent per agent factory.
+
+    The random module is seeded with seeds[k] before the agents of world
+    k are created and placed.  With isolate_random every world also keeps
+    its own random state, swapped in around its programs, so world k
+    plays exactly like a VacuumEnvironment run after random.seed(seeds[k]);
+    this costs a getstate/setstate pair per world and step.  With
+    random_start the agents are placed like XYEnvironment.random_location
+    does, otherwise at the map's start_from.
+
+    The agents' performance and location slots are brought up to date
+    by update_agents(), which run() calls when it is done."""
+
+    def __init__(self, map_factory, agent_factories, seeds,
+                 random_start=False, isolate_random=False):
+        env = map_factory()
+        template = env.to_grid()
+        k, n_agents = len(seeds), len(agent_factories)
+        self.width, self.height = env.width, env.height
+        self.grids = np.repeat(template[np.newaxis], k, axis=0)
+        self.positions = np.zeros((k, n_agents, 2), dtype=np.intp)
+        self.bump = np.zeros((k, n_agents), dtype=bool)
+        self.scores = np.zeros((k, n_agents), dtype=np.int64)
+        self.agents = []
+        self.ids = []
+        self.random_states = []
+        self.isolate_random = isolate_random
+        self.steps = 0
+
+        for world, seed in enumerate(seeds):
+            random.seed(seed)
+            agents = []
+            for slot, factory in enumerate(agent_factories):
+                agent = factory()
+                if getattr(agent, 'id', None) is None:
+                    agent.id = 'agent_{0}'.format(slot + 1)
+                agent.performance = 0
+                if random_start:
+                    location = self.random_location(template)
+                else:
+                    location = env.start_from
+                agent.location = location
+                self.positions[world, slot] = location
+                agents.append(agent)
+            self.agents.append(agents)
+            self.ids.append([
+                ("{0}".format(agent.id),
+                 "{0}".format(getattr(agent, 'name', agent.__class__.__name__)))
+                for agent in agents])
+            self.random_states.append(random.getstate())
+
+    def random_location(self, grid):
+        "Pick a wall-free cell the way XYEnvironment.random_location does."
+        while True:
+            loc = (random.choice(range(self.width)),
+                   random.choice(range(self.height)))
+            if grid[loc] != WALL:
+                return loc
+
+    def percepts(self):
+        """Return status and bump strings and neighbour offsets for every
+        agent, as nested lists indexed [world][agent]."""
+        worlds = np.arange(len(self.grids))[:, np.newaxis]
+        dirty = self.grids[worlds, self.positions[..., 0],
+                           self.positions[..., 1]] == DIRT
+        offsets = self.positions[:, np.newaxis] - \
+            self.positions[:, :, np.newaxis]
+        return ([[STATUS[d] for d in row] for row in dirty.tolist()],
+                [[BUMP[b] for b in row] for row in self.bump.tolist()],
+                offsets.tolist())
+
+    def step(self):
+        """Ask every agent of every world for an action, then apply the
+        actions of each agent slot to all the worlds at once."""
+        status, bump, offsets = self.percepts()
+        actions = np.empty(self.scores.shape, dtype=np.intp)
+        for world, agents in enumerate(self.agents):
+            if self.isolate_random:
+                random.setstate(self.random_states[world])
+            for slot, agent in enumerate(agents):
+                neighbors = [(id_, tuple(offset)) for id_, offset
+                             in zip(self.ids[world], offsets[world][slot])]
+                action = agent.program(status[world][slot],
+                                       bump[world][slot], neighbors)
+                actions[world, slot] = ACTION_CODES.get(action, OTHER)
+            if self.isolate_random:
+                self.random_states[world] = random.getstate()
+        for slot in range(actions.shape[1]):
+            self.execute_actions(slot, actions[:, slot])
+        self.steps += 1
+
+    def execute_actions(self, slot, actions):
+        "Apply one action per world to the agent in the given slot."
+        worlds = np.arange(len(self.grids))
+        x, y = self.positions[:, slot, 0], self.positions[:, slot, 1]
+
+        suck = actions == SUCK
+        cleaned = suck & (self.grids[worlds, x, y] == DIRT)
+        self.grids[worlds[cleaned], x[cleaned], y[cleaned]] = CLEAN
+        self.scores[cleaned, slot] += 100
+        self.scores[suck & ~cleaned, slot] -= 20
+
+        moving = actions >= GO_NORTH
+        dest = self.positions[:, slot] + MOVES[actions]
+        inside = ((dest >= 0) &
+                  (dest < self.grids.shape[1:])).all(axis=1)
+        dest_x = np.clip(dest[:, 0], 0, self.grids.shape[1] - 1)
+        dest_y = np.clip(dest[:, 1], 0, self.grids.shape[2] - 1)
+        blocked = ~inside | (self.grids[worlds, dest_x, dest_y] == WALL)
+        self.bump[moving, slot] = blocked[moving]
+        go = moving & ~blocked
+        self.positions[go, slot] = dest[go]
+        self.scores[moving, slot] -= 5
+
+    def update_agents(self):
+        "Copy scores and locations back to the agent objects."
+        scores = self.scores.tolist()
+        positions = self.positions.tolist()
+        for world, agents in enumerate(self.agents):
+            for slot, agent in enumerate(agents):
+                agent.performance = scores[world][slot]
+                agent.location = tuple(positions[world][slot])
+                agent.bump = bool(self.bump[world, slot])
+
+    def run(self, steps=1000):
+        "Run all the worlds for the given number of time steps."
+        for step in range(steps):
+            self.step()
+        self.update_agents()
+
+    def dirt_left(self):
+        "Return the number of dirty cells left in each world."
+        return (self.grids == DIRT).sum(axis=(1, 2))